@@ -1,94 +1,188 @@
 # backend/app/api/v1/endpoints/diagram.py
 
-from fastapi import APIRouter, HTTPException, Form, BackgroundTasks, Request
-from backend.app.models.schemas import DiagramResponse, CodeExecutionResponse, CodeExecutionRequest
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Form
+from fastapi.responses import StreamingResponse
+from backend.app.models.schemas import (
+    DiagramResponse, CodeExecutionResponse, CodeExecutionRequest,
+    BatchGenerateRequest, BatchGenerateResponse, BatchItemResult,
+)
+from backend.config import BATCH_MAX_CONCURRENCY, BATCH_MAX_ITEMS
 from backend.app.services.architecture_diagram import ArchitectureService
-from backend.app.services.diagram_service import DiagramService
-import os
-import shutil
-import threading
-import time
+from backend.app.services.diagram_service import DiagramService, CODE_EXE_DIR
+from backend.app.services.llm_client import LLMError
+from backend.app.services.render_cache import render_cache
+from backend.app.services.llm_cache import llm_cache
+from backend.app.services.expiry_manager import expiry_manager
+from backend.app.services.artifact_store import artifact_store
+from backend.app.services.derivative_store import derivative_store
+from backend.app.services.layout_cache import layout_cache
+from backend.app.services.prompt_compiler import prompt_compiler
+from backend.app.utils.helpers import image_url
+import asyncio
+import json
 
 router = APIRouter()
 
-def cleanup_files(directory: str):
-    """Delete all files and subdirectories in the specified directory."""
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print(f'Failed to delete {file_path}. Reason: {e}')
+def check_output_mode(mode: Optional[str]) -> str:
+    try:
+        return DiagramService.output_mode(mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def run_generation(cloud_provider: str, project_description: str, mode: str = None) -> DiagramResponse:
+    # Process the project description
+    architecture, diagram_code = await DiagramService.generate_architecture_and_diagram(
+        project_description, cloud_provider, mode
+    )
+    images, errors = await DiagramService.render_images(diagram_code)
 
-def delayed_cleanup(directory: str, delay: int = 10):
-    """Wait for 'delay' seconds before cleaning up files."""
-    def run():
-        time.sleep(delay)
-        cleanup_files(directory)
-    thread = threading.Thread(target=run)
-    thread.start()
+    # Prepend the server URL to image paths
+    image_urls = [image_url(image) for image in images]
+
+    return DiagramResponse(
+        architectural_description=architecture['architectural_description'],
+        icon_category_list=architecture['icon_category_list'],
+        diagram_code=diagram_code,
+        image_urls=image_urls,
+        errors=errors
+    )
 
 @router.post("/generate", response_model=DiagramResponse)
 async def generate_diagram(
-    background_tasks: BackgroundTasks,
     cloud_provider: str = Form(...),
-    project_description: str = Form(...)
+    project_description: str = Form(...),
+    mode: Optional[str] = Form(None)
 ):
+    mode = check_output_mode(mode)
     try:
-        # Process the project description
-        architecture = ArchitectureService.process_project_description(project_description, cloud_provider)
-        diagram_code = DiagramService.generate_diagram(architecture, cloud_provider)
-        images = DiagramService.execute_code_and_get_images(diagram_code)
+        return await run_generation(cloud_provider, project_description, mode)
+    except LLMError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Prepend the server URL to image paths
-        server_url = os.getenv("SERVER_URL", "http://localhost:8000")
-        image_urls = [f"{server_url}/images/{os.path.basename(image)}" for image in images]
+@router.post("/generate/batch", response_model=BatchGenerateResponse)
+async def generate_diagram_batch(request_data: BatchGenerateRequest):
+    """Run /generate for many projects concurrently, optionally streaming results as NDJSON."""
+    if len(request_data.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_ITEMS} items")
+    for item in request_data.items:
+        check_output_mode(item.mode)
 
-        response = DiagramResponse(
-            architectural_description=architecture['architectural_description'],
-            icon_category_list=architecture['icon_category_list'],
-            diagram_code=diagram_code,
-            image_urls=image_urls
-        )
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
 
-        # Schedule the cleanup task with a delay to ensure images are accessible
-        execution_dir = os.path.join(os.getcwd(), 'code_exe')
-        background_tasks.add_task(delayed_cleanup, execution_dir, delay=20)  # 10-second delay
+    async def run_item(index: int, item) -> BatchItemResult:
+        async with semaphore:
+            try:
+                result = await run_generation(item.cloud_provider, item.project_description, item.mode)
+                return BatchItemResult(index=index, status="succeeded", result=result)
+            except Exception as e:
+                return BatchItemResult(index=index, status="failed", error=str(e))
 
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(request_data.items)]
+
+    if not request_data.stream:
+        return BatchGenerateResponse(results=await asyncio.gather(*tasks))
+
+    async def lines():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item_result = await next_done
+                yield item_result.model_dump_json() + "\n"
+        finally:
+            # Stop the remaining items if the client goes away
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
     
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/generate/stream")
+async def generate_diagram_stream(
+    cloud_provider: str = Form(...),
+    project_description: str = Form(...),
+    mode: Optional[str] = Form(None)
+):
+    """Stream the /generate pipeline as Server-Sent Events, one event per finished stage."""
+    mode = check_output_mode(mode)
+
+    async def events():
+        try:
+            architecture = await ArchitectureService.process_project_description(project_description, cloud_provider)
+            yield sse_event("architecture", {
+                "architectural_description": architecture['architectural_description'],
+                "icon_category_list": architecture['icon_category_list'],
+            })
+
+            chunks = []
+            async for delta in DiagramService.stream_diagram(architecture, cloud_provider, mode):
+                chunks.append(delta)
+                yield sse_event("code_delta", {"delta": delta})
+            diagram_code = "".join(chunks)
+            yield sse_event("code", {"diagram_code": diagram_code})
+
+            image_count = 0
+            async for index, result in DiagramService.iter_renders(diagram_code, CODE_EXE_DIR):
+                for image in result['images']:
+                    image_count += 1
+                    yield sse_event("image", {"diagram": index + 1, "image_url": image_url(image)})
+                if result['error']:
+                    yield sse_event("diagram_error", {"diagram": index + 1, "error": result['error']})
+            yield sse_event("done", {"image_count": image_count})
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/execute-code", response_model=CodeExecutionResponse)
 async def execute_code_endpoint(
-    background_tasks: BackgroundTasks,
     request_data: CodeExecutionRequest,
 ):
     try:
         diagram_code = request_data.diagram_code
         architectural_description = request_data.architectural_description
 
-        images = DiagramService.execute_updated_code_and_get_images(diagram_code)
+        images, errors = await DiagramService.render_updated_images(diagram_code)
 
         # Prepend the server URL to image paths
-        server_url = os.getenv("SERVER_URL", "http://localhost:8000")
-        image_urls = [
-            f"{server_url}/updated_images/{os.path.basename(image)}" for image in images
-        ]
+        image_urls = [image_url(image) for image in images]
 
         response = CodeExecutionResponse(
             diagram_code=diagram_code,
             architectural_description=architectural_description,
             image_urls=image_urls,
+            errors=errors,
         )
 
-        # Schedule the cleanup task
-        execution_dir = os.path.join(os.getcwd(), "updated_code_files")
-        background_tasks.add_task(delayed_cleanup, execution_dir, delay=20)  # 20-second delay
-
         return response
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/render-cache/stats")
+def render_cache_stats():
+    return render_cache.stats()
+
+@router.get("/layout-cache/stats")
+def layout_cache_stats():
+    return layout_cache.stats()
+
+@router.get("/llm-cache/stats")
+def llm_cache_stats():
+    return llm_cache.stats()
+
+@router.get("/artifacts/stats")
+def artifact_stats():
+    return {**artifact_store.stats(), **derivative_store.stats(), **expiry_manager.stats()}
+
+@router.get("/prompts/stats")
+def prompt_stats():
+    return prompt_compiler.stats()
@@ -0,0 +1,83 @@
+# backend/app/api/v1/endpoints/images.py
+
+import os
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from backend.config import ARTIFACT_REDIRECT
+from backend.app.services.artifact_store import artifact_store
+from backend.app.services.derivative_store import derivative_store, FORMATS, VARIANTS
+from backend.app.services.graph_spec import GraphvizError
+from backend.app.services.storage_backend import IMMUTABLE_CACHE_CONTROL
+
+router = APIRouter()
+
+def accepts_gzip(request: Request) -> bool:
+    return 'gzip' in request.headers.get('accept-encoding', '').lower()
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match', '')
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+# '/updated_images' is kept for links handed out before both routes shared one store
+@router.get("/images/{key:path}")
+@router.get("/updated_images/{key:path}")
+def get_image(key: str, request: Request, format: Optional[str] = None, variant: str = "full"):
+    if not artifact_store.is_valid_key(key):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    extension = os.path.splitext(key)[1]
+    if extension == '.svg' and (format not in (None, 'svg') or variant != "full"):
+        return get_derivative(key, request, format or 'png', variant)
+
+    if ARTIFACT_REDIRECT:
+        url = artifact_store.url(key)
+        if url is not None:
+            # The backend serves the bytes, so no API worker has to
+            return RedirectResponse(url, status_code=307)
+
+    compress = extension == '.svg' and accepts_gzip(request)
+    digest = artifact_store.digest(key)
+    etag = f'"{digest}-gzip"' if compress else f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if extension == '.svg':
+        headers["Vary"] = "Accept-Encoding"
+
+    if etag_matches(request, etag) and artifact_store.exists(key):
+        return Response(status_code=304, headers=headers)
+
+    if compress:
+        data = artifact_store.get_gzipped(key)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=data, media_type=artifact_store.media_type(key), headers=headers)
+
+    chunks = artifact_store.iter_chunks(key)
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return StreamingResponse(chunks, media_type=artifact_store.media_type(key), headers=headers)
+
+def get_derivative(key: str, request: Request, output_format: str, variant: str):
+    """Serve a raster variant of an SVG artifact, rendering it on first request."""
+    if output_format not in FORMATS or variant not in VARIANTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Supported formats: {', '.join(FORMATS)}; variants: {', '.join(VARIANTS)}",
+        )
+    digest = artifact_store.digest(key)
+    _, extension, media_type = FORMATS[output_format]
+    # Variants are derived deterministically from the content-addressed SVG, so they are immutable too
+    etag = f'"{digest}-{variant}{extension}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data = derivative_store.get(digest, output_format, variant)
+    except GraphvizError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image variant not available")
+    return Response(content=data, media_type=media_type, headers=headers)
@@ -0,0 +1,98 @@
+# backend/app/api/v1/endpoints/jobs.py
+
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Form
+from backend.app.models.schemas import (
+    DiagramResponse, CodeExecutionResponse, CodeExecutionRequest, JobSubmitResponse, JobStatusResponse
+)
+from backend.config import PIPELINE_MODE
+from backend.app.services.architecture_diagram import ArchitectureService
+from backend.app.services.diagram_service import DiagramService
+from backend.app.services.job_scheduler import job_scheduler, QueueFullError
+from backend.app.utils.helpers import image_url
+
+router = APIRouter()
+
+def submit(kind: str, pipeline) -> JobSubmitResponse:
+    try:
+        job = job_scheduler.submit(kind, pipeline)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return JobSubmitResponse(job_id=job.id, status=job.status)
+
+@router.post("/generate", response_model=JobSubmitResponse, status_code=202)
+async def submit_generate_job(
+    cloud_provider: str = Form(...),
+    project_description: str = Form(...),
+    mode: Optional[str] = Form(None)
+):
+    try:
+        mode = DiagramService.output_mode(mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def pipeline(job):
+        if PIPELINE_MODE == "pipelined":
+            # llm1 and llm2 overlap, so they share one stage
+            architecture, diagram_code = await job_scheduler.run_stage(
+                job, "architecture_and_diagram_code", "llm",
+                lambda: DiagramService.generate_architecture_and_diagram(project_description, cloud_provider, mode),
+            )
+        else:
+            architecture = await job_scheduler.run_stage(
+                job, "architecture", "llm",
+                lambda: ArchitectureService.process_project_description(project_description, cloud_provider),
+            )
+            diagram_code = await job_scheduler.run_stage(
+                job, "diagram_code", "llm",
+                lambda: DiagramService.generate_diagram(architecture, cloud_provider, mode),
+            )
+        images, errors = await job_scheduler.run_stage(
+            job, "render", "render", lambda: DiagramService.render_images(diagram_code)
+        )
+        return DiagramResponse(
+            architectural_description=architecture['architectural_description'],
+            icon_category_list=architecture['icon_category_list'],
+            diagram_code=diagram_code,
+            image_urls=[image_url(image) for image in images],
+            errors=errors,
+        )
+
+    return submit("generate", pipeline)
+
+@router.post("/execute-code", response_model=JobSubmitResponse, status_code=202)
+async def submit_execute_code_job(request_data: CodeExecutionRequest):
+    async def pipeline(job):
+        images, errors = await job_scheduler.run_stage(
+            job, "render", "render",
+            lambda: DiagramService.render_updated_images(request_data.diagram_code),
+        )
+        return CodeExecutionResponse(
+            diagram_code=request_data.diagram_code,
+            architectural_description=request_data.architectural_description,
+            image_urls=[image_url(image) for image in images],
+            errors=errors,
+        )
+
+    return submit("execute-code", pipeline)
+
+@router.get("/stats")
+def job_stats():
+    return job_scheduler.stats()
+
+@router.get("/{job_id}", response_model=JobStatusResponse)
+def get_job(job_id: str):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatusResponse(
+        job_id=job.id,
+        kind=job.kind,
+        status=job.status,
+        stage=job.stage,
+        queue_position=job_scheduler.queue_position(job),
+        timings=job.timings,
+        result=job.result,
+        error=job.error,
+    )
@@ -0,0 +1,12 @@
+# backend/app/api/v1/endpoints/metrics.py
+
+from fastapi import APIRouter, Response
+from backend.app.services.metrics import metrics
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@router.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,11 +1,15 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from backend.app.api.v1.enpoints import diagram, test
+from backend.app.api.v1.enpoints import diagram, images, jobs, metrics as metrics_endpoint, test
+from backend.app.services.diagram_service import DiagramService
+from backend.app.services.llm_client import close_async_client
+from backend.app.services.llm_cache import llm_cache
+from backend.app.services.expiry_manager import expiry_manager
+from backend.app.services.storage_backend import artifact_backend, derivative_backend
+from backend.app.services.metrics import metrics
+from backend.config import SERVER_TIMING_ENABLED
 
 import os
-import time
-from threading import Thread
 
 app = FastAPI(
     title="Cloud Architecture Diagram Generator",
@@ -23,8 +27,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+if SERVER_TIMING_ENABLED:
+    @app.middleware("http")
+    async def add_server_timing(request: Request, call_next):
+        # Streaming responses only include the stages finished before the first byte
+        timings = metrics.start_request()
+        response = await call_next(request)
+        if timings:
+            response.headers["Server-Timing"] = metrics.server_timing(timings)
+        return response
+
 # Set the root directory
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.abspath(os.path.join(ROOT_DIR, "../../"))
@@ -35,39 +50,26 @@ updated_code_files_dir = os.path.join(BASE_DIR, "updated_code_files")
 os.makedirs(code_exe_dir, exist_ok=True)
 os.makedirs(updated_code_files_dir, exist_ok=True)
 
-# Mount the 'code_exe' and 'updated_code_files' directories to serve static files
-app.mount("/images", StaticFiles(directory=code_exe_dir), name="images")
-app.mount("/updated_images", StaticFiles(directory=updated_code_files_dir), name="updated_images")
-
+app.include_router(images.router, tags=["Images"])
+app.include_router(metrics_endpoint.router, tags=["Metrics"])
 app.include_router(diagram.router, prefix="/api/v1/diagrams", tags=["Diagrams"])
+app.include_router(jobs.router, prefix="/api/v1/jobs", tags=["Jobs"])
 app.include_router(test.router, prefix="/api/v1/test", tags=["Test"])
 
 @app.get("/", tags=["Root"])
 def read_root():
     return {"message": "Server is running smoothly."}
 
-def cleanup_old_files(directory: str, max_age_seconds: int = 300):
-    while True:
-        now = time.time()
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            if os.path.isfile(file_path):
-                file_age = now - os.path.getmtime(file_path)
-                if file_age > max_age_seconds:
-                    try:
-                        os.remove(file_path)
-                        print(f"Deleted old file: {file_path}")
-                    except Exception as e:
-                        print(f"Failed to delete {file_path}. Reason: {e}")
-        time.sleep(60)  # Run cleanup every 60 seconds
-
-def start_cleanup_threads():
-    directories = [code_exe_dir, updated_code_files_dir]
-    for directory in directories:
-        thread = Thread(target=cleanup_old_files, args=(directory,))
-        thread.daemon = True
-        thread.start()
-
 @app.on_event("startup")
 def on_startup():
-    start_cleanup_threads()
\ No newline at end of file
+    artifact_backend.track_existing()
+    derivative_backend.track_existing()
+    expiry_manager.start()
+    DiagramService.start_renderer_pool()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await close_async_client()
+    DiagramService.shutdown_executor()
+    llm_cache.close()
+    expiry_manager.stop()
@@ -1,13 +1,18 @@
 # backend/app/models/schemas.py
 
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, List, Optional, Union
+
+class DiagramError(BaseModel):
+    diagram: int
+    error: str
 
 class DiagramResponse(BaseModel):
     architectural_description: str
     icon_category_list: List[str]
     diagram_code: str
     image_urls: List[str]
+    errors: List[DiagramError] = []
 
 class CodeExecutionRequest(BaseModel):
     diagram_code: str
@@ -16,4 +21,41 @@ class CodeExecutionRequest(BaseModel):
 class CodeExecutionResponse(BaseModel):
     diagram_code: str
     architectural_description: str
-    image_urls: List[str]
\ No newline at end of file
+    image_urls: List[str]
+    errors: List[DiagramError] = []
+
+class BatchGenerateItem(BaseModel):
+    cloud_provider: str
+    project_description: str
+    mode: Optional[str] = None
+
+class BatchGenerateRequest(BaseModel):
+    items: List[BatchGenerateItem]
+    stream: bool = False
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: str
+    result: Optional[DiagramResponse] = None
+    error: Optional[str] = None
+
+class BatchGenerateResponse(BaseModel):
+    results: List[BatchItemResult]
+
+class StageTiming(BaseModel):
+    wait_seconds: float
+    run_seconds: float
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    stage: Optional[str] = None
+    queue_position: Optional[int] = None
+    timings: Dict[str, StageTiming] = {}
+    result: Optional[Union[DiagramResponse, CodeExecutionResponse]] = None
+    error: Optional[str] = None
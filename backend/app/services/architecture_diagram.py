@@ -1,42 +1,112 @@
 # architecture_service.py
 
-import openai
-from backend.config import OPENAI_API_KEY, llm1, llm1_schema, aws_categories, azure_categories, gcp_categories
+import asyncio
+import json
+import re
+from backend.config import llm1, llm1_schema, LLM_MODEL
+from backend.app.services.llm_client import chat_completion, stream_chat_completion
+from backend.app.services.llm_cache import llm_cache
+from backend.app.services.prompt_compiler import prompt_compiler
+from backend.app.services.single_flight import architecture_flights, architecture_stream_flights
+
+_CATEGORY_LIST_PATTERN = re.compile(r'"icon_category_list"\s*:\s*')
+
+def partial_category_list(buffer: str):
+    """Return icon_category_list from a partially streamed llm1 reply once the array is complete."""
+    match = _CATEGORY_LIST_PATTERN.search(buffer)
+    if match is None:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(buffer, match.end())
+    except ValueError:
+        return None
+    return value if isinstance(value, list) else None
 
 class ArchitectureService:
-    openai.api_key = OPENAI_API_KEY
+    @staticmethod
+    def _cache_key(project_description: str, cloud_provider: str) -> str:
+        return llm_cache.make_key("architecture", project_description, cloud_provider, LLM_MODEL, llm1)
 
     @staticmethod
-    def process_project_description(project_description: str, cloud_provider:str):
-
-        if cloud_provider == "aws":
-            icon_list = aws_categories
-        elif cloud_provider == "azure":
-            icon_list = azure_categories
-        elif cloud_provider == "gcp":
-            icon_list = gcp_categories
-
-        prompt = llm1.format(
-            project_description=project_description,
-            categories=icon_list,
-            cloud_provider=cloud_provider
-        )
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+    def _request(project_description: str, cloud_provider: str):
+        prompt = prompt_compiler.architecture_prompt(cloud_provider, project_description)
+        print(f"Architecture prompt tokens: {prompt.tokens}")
+        return prompt.tokens, {
+            "model": LLM_MODEL,
+            "messages": [
                 {"role": "system", "content": "Here is Your Task"},
-                {"role": "user", "content": prompt}
+                {"role": "user", "content": prompt.text}
             ],
-            response_format={
+            "response_format": {
                 "type": "json_schema",
                 "json_schema": llm1_schema
-            }
+            },
+        }
+
+    @staticmethod
+    async def process_project_description(project_description: str, cloud_provider:str):
+        cache_key = ArchitectureService._cache_key(project_description, cloud_provider)
+        # Identical requests in flight at the same time (e.g. a double submit) share one llm1 call
+        return await architecture_flights.run(
+            cache_key,
+            lambda: ArchitectureService._process(cache_key, project_description, cloud_provider),
         )
+
+    @staticmethod
+    async def _process(cache_key: str, project_description: str, cloud_provider: str):
+        cached = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached is not None:
+            return ArchitectureService.parse_response(cached)
+
+        prompt_tokens, request = ArchitectureService._request(project_description, cloud_provider)
+        response = await chat_completion("architecture", prompt_tokens, **request)
         result = response.choices[0].message.content
         architecture = ArchitectureService.parse_response(result)
         print(f"Architecture: {architecture}")
+        await asyncio.to_thread(llm_cache.set, cache_key, "architecture", result)
         return architecture
 
+    @staticmethod
+    async def stream_project_description(project_description: str, cloud_provider: str):
+        """Stream llm1, yielding ("categories", list) early and ("architecture", dict) at the end.
+
+        llm1_schema lists icon_category_list first, so structured output
+        completes it well before the much longer architectural description.
+        """
+        cache_key = ArchitectureService._cache_key(project_description, cloud_provider)
+        # Identical streams in flight at the same time share one llm1 call; late joiners replay its events
+        async for event in architecture_stream_flights.stream(
+            cache_key,
+            lambda: ArchitectureService._stream(cache_key, project_description, cloud_provider),
+        ):
+            yield event
+
+    @staticmethod
+    async def _stream(cache_key: str, project_description: str, cloud_provider: str):
+        cached = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached is not None:
+            architecture = ArchitectureService.parse_response(cached)
+            yield "categories", architecture['icon_category_list']
+            yield "architecture", architecture
+            return
+
+        prompt_tokens, request = ArchitectureService._request(project_description, cloud_provider)
+        chunks = []
+        categories = None
+        async for delta in stream_chat_completion("architecture", prompt_tokens, **request):
+            chunks.append(delta)
+            if categories is None:
+                categories = partial_category_list("".join(chunks))
+                if categories is not None:
+                    yield "categories", categories
+        result = "".join(chunks)
+        architecture = ArchitectureService.parse_response(result)
+        if categories is None:
+            yield "categories", architecture['icon_category_list']
+        print(f"Architecture: {architecture}")
+        await asyncio.to_thread(llm_cache.set, cache_key, "architecture", result)
+        yield "architecture", architecture
+
     @staticmethod
     def parse_response(response: str):
         import json
@@ -0,0 +1,168 @@
+# artifact_store.py
+
+import gzip
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from backend.config import ARTIFACT_MEMORY_BYTES
+from backend.app.services.storage_backend import StorageBackend, artifact_backend, CHUNK_SIZE
+
+KEY_PATTERN = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.(png|jpg|jpeg|svg)$")
+
+MEDIA_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.svg': 'image/svg+xml',
+}
+
+class ArtifactStore:
+    """Content-addressed image store keyed as ab/cd/<sha256><ext>.
+
+    Every artifact is written through to the storage backend, so any worker
+    or node sharing the backend can serve it. The most recently used ones
+    are also kept in a memory-bounded LRU in front of the backend.
+    """
+
+    def __init__(self, backend: StorageBackend, memory_bytes: int):
+        self.backend = backend
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(digest: str, extension: str) -> str:
+        return f"{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}"
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return KEY_PATTERN.match(key) is not None
+
+    @staticmethod
+    def digest(key: str) -> str:
+        return os.path.splitext(key.rsplit('/', 1)[-1])[0]
+
+    @staticmethod
+    def media_type(key: str) -> str:
+        return MEDIA_TYPES[os.path.splitext(key)[1]]
+
+    def exists(self, key: str) -> bool:
+        # The memory tier only speeds up this process; other workers can serve only what the backend holds
+        return self.backend.exists(key)
+
+    def _remember(self, key: str, entry: dict):
+        """Insert entry into the memory tier, evicting the least recently used ones to make room."""
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_used -= previous['size']
+            self._memory[key] = entry
+            self._memory_used += entry['size']
+            # Evicted entries are already in the backend, so dropping them costs no write
+            while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+                _, old_entry = self._memory.popitem(last=False)
+                self._memory_used -= old_entry['size']
+
+    def put_bytes(self, data: bytes, extension: str) -> str:
+        """Store rendered bytes and return their key."""
+        key = self.key_for(hashlib.sha256(data).hexdigest(), extension)
+        # Unchanged content only gets a later expiry; the backend copy may have expired even if memory holds it
+        if not self.backend.refresh(key):
+            self.backend.put(key, data, content_type=self.media_type(key))
+        with self._lock:
+            cached = key in self._memory
+            if cached:
+                self._memory.move_to_end(key)
+        if not cached:
+            self._remember(key, {'data': data, 'gzip': None, 'size': len(data)})
+        return key
+
+    def put_file(self, source_path: str, keep_source: bool = False) -> str:
+        """Stream a finished file into the backend and return its key."""
+        digest = hashlib.sha256()
+        with open(source_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+            key = self.key_for(digest.hexdigest(), os.path.splitext(source_path)[1])
+            if not self.backend.refresh(key):
+                file.seek(0)
+                self.backend.put_stream(key, file, content_type=self.media_type(key))
+        if not keep_source:
+            os.remove(source_path)
+        return key
+
+    def _entry(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        data = self.backend.get(key)
+        if data is None:
+            return None
+        entry = {'data': data, 'gzip': None, 'size': len(data)}
+        self._remember(key, entry)
+        return entry
+
+    def get(self, key: str):
+        """Return the artifact bytes, or None if it is unknown or expired."""
+        entry = self._entry(key)
+        return entry['data'] if entry is not None else None
+
+    def iter_chunks(self, key: str):
+        """Return an iterator over the artifact bytes, or None if it is unknown or expired.
+
+        Memory misses are streamed from the backend and promoted into memory
+        once they have been read in full.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return iter([entry['data']])
+        chunks = self.backend.iter_chunks(key)
+        if chunks is None:
+            return None
+
+        def promote():
+            received = []
+            for chunk in chunks:
+                received.append(chunk)
+                yield chunk
+            data = b''.join(received)
+            self._remember(key, {'data': data, 'gzip': None, 'size': len(data)})
+        return promote()
+
+    def get_gzipped(self, key: str):
+        """Return the gzip-compressed artifact bytes, compressing once and caching the result."""
+        entry = self._entry(key)
+        if entry is None:
+            return None
+        if entry['gzip'] is None:
+            compressed = gzip.compress(entry['data'], compresslevel=6, mtime=0)
+            with self._lock:
+                if entry['gzip'] is None:
+                    entry['gzip'] = compressed
+                    entry['size'] += len(compressed)
+                    if self._memory.get(key) is entry:
+                        self._memory_used += len(compressed)
+        return entry['gzip']
+
+    def url(self, key: str):
+        """A URL clients can fetch the artifact from directly, or None."""
+        return self.backend.url(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.backend.stats(),
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_used,
+                'memory_budget_bytes': self.memory_bytes,
+            }
+
+artifact_store = ArtifactStore(artifact_backend, ARTIFACT_MEMORY_BYTES)
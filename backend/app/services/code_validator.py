@@ -0,0 +1,241 @@
+# code_validator.py
+
+import ast
+import difflib
+import importlib
+import types
+
+from backend.app.services.icon_catalog import icon_catalog
+
+# Names the generated code has no business calling
+FORBIDDEN_CALLS = {
+    'exec', 'eval', 'compile', 'open', '__import__', 'getattr', 'setattr', 'delattr',
+    'globals', 'locals', 'vars', 'input', 'breakpoint', 'exit', 'quit',
+}
+
+# How similar (difflib ratio, 2 * matching chars / total chars) an unknown icon name must be
+# to a valid one to be rewritten: 'Userr' -> 'User' scores 0.89, 'Lamda' -> 'Lambda' 0.91
+ICON_MATCH_CUTOFF = 0.75
+
+_MISSING = object()
+
+def _member(module: types.ModuleType, name: str):
+    """Resolve module.name as the generated code would see it, importing submodules as needed."""
+    value = getattr(module, name, _MISSING)
+    if value is _MISSING:
+        try:
+            value = importlib.import_module(f"{module.__name__}.{name}")
+        except ImportError:
+            pass
+    return value
+
+def _is_diagrams_object(value) -> bool:
+    """Only diagrams' own modules and classes may be reached; diagrams imports os, uuid and more."""
+    if isinstance(value, types.ModuleType):
+        return value.__name__ == 'diagrams' or value.__name__.startswith('diagrams.')
+    return isinstance(value, type) and (value.__module__ == 'diagrams' or value.__module__.startswith('diagrams.'))
+
+def _binding(icon: str, alias: ast.alias):
+    """Alias a rewritten icon to the name the code imported, so the rest of the code is untouched."""
+    name = alias.asname or alias.name
+    return None if name == icon else name
+
+class ValidationResult:
+    def __init__(self, code: str, errors: list, rewrites: list):
+        self.code = code
+        self.errors = errors
+        self.rewrites = rewrites
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+def closest_icon(name: str, icons: list):
+    """Return the valid icon closest to name, trying a case-insensitive match first."""
+    for icon in icons:
+        if icon.lower() == name.lower():
+            return icon
+    matches = difflib.get_close_matches(name, icons, n=1, cutoff=ICON_MATCH_CUTOFF)
+    return matches[0] if matches else None
+
+class _Validator(ast.NodeVisitor):
+    def __init__(self):
+        self.errors = []
+        self.rewrites = []
+        # (node, replacement source) pairs applied to the original text afterwards
+        self.edits = []
+        # Names bound to diagrams modules, which may only be used for attribute access
+        self.modules = {}
+        self._attribute_bases = set()
+
+    def error(self, node: ast.AST, message: str):
+        self.errors.append(f"line {node.lineno}: {message}")
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            if alias.name != 'diagrams' and not alias.name.startswith('diagrams.'):
+                self.error(node, f"import of '{alias.name}' is not allowed")
+                continue
+            try:
+                module = importlib.import_module(alias.name)
+            except ImportError:
+                self.error(node, f"'{alias.name}' is not a diagrams module")
+                continue
+            if alias.asname:
+                self.modules[alias.asname] = module
+            else:
+                self.modules[alias.name.split('.')[0]] = importlib.import_module('diagrams')
+
+    def _check_members(self, node: ast.ImportFrom, module_name: str):
+        """Allow only diagrams modules and classes to be imported from module_name.
+
+        Used for modules outside the icon catalog (e.g. diagrams.onprem.*);
+        near-miss class names are rewritten against the module's own classes.
+        """
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            self.error(node, f"'{module_name}' is not a diagrams module")
+            return
+        fixed_names = []
+        changed = False
+        for alias in node.names:
+            fixed_names.append(alias)
+            if alias.name == '*':
+                names = getattr(module, '__all__', [name for name in vars(module) if not name.startswith('_')])
+                if not all(_is_diagrams_object(_member(module, name)) for name in names):
+                    self.error(node, f"'from {module_name} import *' is not allowed")
+                continue
+            value = _member(module, alias.name)
+            if value is _MISSING:
+                classes = [
+                    name for name, member in vars(module).items()
+                    if not name.startswith('_') and isinstance(member, type) and _is_diagrams_object(member)
+                ]
+                icon = closest_icon(alias.name, classes)
+                if icon is None:
+                    self.error(node, f"'{alias.name}' is not a valid icon in {module_name}")
+                    continue
+                fixed_names[-1] = ast.alias(icon, _binding(icon, alias))
+                self.rewrites.append(f"{module_name}.{alias.name} -> {module_name}.{icon}")
+                changed = True
+            elif not _is_diagrams_object(value):
+                self.error(node, f"import of '{alias.name}' from '{module_name}' is not allowed")
+            elif isinstance(value, types.ModuleType):
+                self.modules[alias.asname or alias.name] = value
+        if changed:
+            self.edits.append((node, ast.unparse(ast.ImportFrom(module=module_name, names=fixed_names, level=0))))
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        module = node.module or ''
+        if node.level or (module != 'diagrams' and not module.startswith('diagrams.')):
+            self.error(node, f"import from '{module}' is not allowed")
+            return
+        parts = module.split('.')
+        if len(parts) != 3 or parts[1] not in icon_catalog.providers:
+            self._check_members(node, module)
+            return
+        provider, category = parts[1], parts[2]
+        if category not in icon_catalog.categories(provider):
+            self.error(node, f"'{module}' is not a known {provider} category")
+            return
+
+        icons = icon_catalog.icons(provider, category)
+        fixed_imports = {}
+        changed = False
+        for alias in node.names:
+            if alias.name in icons:
+                fixed_imports.setdefault(module, []).append(ast.alias(alias.name, alias.asname))
+                continue
+            icon, fixed_module = closest_icon(alias.name, icons), module
+            if icon is None:
+                # The icon may exist under another category of the same provider
+                locations = icon_catalog.locate(alias.name, provider)
+                if locations:
+                    icon, fixed_module = alias.name, f"diagrams.{provider}.{locations[0][1]}"
+            if icon is None:
+                self.error(node, f"'{alias.name}' is not a valid icon in {module}")
+                continue
+            # Alias the valid icon to the old name so the rest of the code is untouched
+            fixed_imports.setdefault(fixed_module, []).append(ast.alias(icon, _binding(icon, alias)))
+            self.rewrites.append(f"{module}.{alias.name} -> {fixed_module}.{icon}")
+            changed = True
+
+        if changed:
+            replacement = "; ".join(
+                ast.unparse(ast.ImportFrom(module=fixed_module, names=names, level=0))
+                for fixed_module, names in fixed_imports.items()
+            ) or "pass"
+            self.edits.append((node, replacement))
+
+    def visit_Call(self, node: ast.Call):
+        if isinstance(node.func, ast.Name) and node.func.id in FORBIDDEN_CALLS:
+            self.error(node, f"call to '{node.func.id}' is not allowed")
+        if isinstance(node.func, ast.Name) and node.func.id == 'Diagram':
+            for keyword in node.keywords:
+                if keyword.arg == 'show' and not (
+                    isinstance(keyword.value, ast.Constant) and keyword.value.value is False
+                ):
+                    self.edits.append((keyword.value, "False"))
+                    self.rewrites.append(f"line {node.lineno}: Diagram(show=...) -> show=False")
+        self.generic_visit(node)
+
+    def _static_module(self, node: ast.AST):
+        """The diagrams module an expression like 'diagrams.aws' refers to, or None."""
+        if isinstance(node, ast.Name):
+            return self.modules.get(node.id)
+        if isinstance(node, ast.Attribute):
+            base = self._static_module(node.value)
+            if base is not None:
+                value = _member(base, node.attr)
+                if isinstance(value, types.ModuleType) and _is_diagrams_object(value):
+                    return value
+        return None
+
+    def visit_Attribute(self, node: ast.Attribute):
+        self._attribute_bases.add(id(node.value))
+        if node.attr.startswith('__'):
+            self.error(node, f"access to '{node.attr}' is not allowed")
+        base = self._static_module(node.value)
+        if base is not None:
+            value = _member(base, node.attr)
+            if not _is_diagrams_object(value):
+                self.error(node, f"access to '{base.__name__}.{node.attr}' is not allowed")
+            elif isinstance(value, types.ModuleType) and id(node) not in self._attribute_bases:
+                self.error(node, f"module '{value.__name__}' may only be used to reach diagram classes")
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name):
+        # __builtins__, __loader__, __spec__ and friends lead straight back to __import__
+        if node.id.startswith('__'):
+            self.error(node, f"use of '{node.id}' is not allowed")
+        elif node.id in self.modules and id(node) not in self._attribute_bases:
+            self.error(node, f"module '{node.id}' may only be used to reach diagram classes")
+
+    def visit_While(self, node: ast.While):
+        self.error(node, "while loops are not allowed")
+        self.generic_visit(node)
+
+def _apply_edits(code: str, edits: list) -> str:
+    """Replace the source spans of the given nodes, leaving comments and layout intact."""
+    # ast offsets are UTF-8 byte columns, so splice on encoded lines
+    lines = [line.encode('utf-8') for line in code.splitlines(keepends=True)]
+    for node, replacement in sorted(
+        edits, key=lambda edit: (edit[0].lineno, edit[0].col_offset), reverse=True
+    ):
+        start, end = node.lineno - 1, node.end_lineno - 1
+        head = lines[start][:node.col_offset]
+        tail = lines[end][node.end_col_offset:]
+        lines[start:end + 1] = [head + replacement.encode('utf-8') + tail]
+    return b''.join(lines).decode('utf-8')
+
+def validate_diagram_code(code: str) -> ValidationResult:
+    """Statically check generated diagram code and fix near-miss icon imports."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return ValidationResult(code, [f"line {e.lineno}: syntax error: {e.msg}"], [])
+    validator = _Validator()
+    validator.visit(tree)
+    fixed_code = _apply_edits(code, validator.edits) if validator.edits else code
+    return ValidationResult(fixed_code, validator.errors, validator.rewrites)
@@ -0,0 +1,138 @@
+# derivative_store.py
+
+import base64
+import functools
+import os
+import re
+import threading
+
+from backend.app.services.graph_spec import DIAGRAMS_ROOT, render_dot
+from backend.app.services.renderer_pool import render_slots
+from backend.app.services.storage_backend import StorageBackend, derivative_backend
+
+# Graphviz options for each variant, on top of its defaults (96 dpi)
+VARIANTS = {
+    "full": (),
+    "thumb": ("-Gsize=3,3", "-Gpad=0.2"),
+    "hidpi": ("-Gdpi=192",),
+}
+
+# Requested format -> (Graphviz renderer, file extension, media type)
+FORMATS = {
+    "png": ("png", ".png", "image/png"),
+    "jpg": ("jpg", ".jpg", "image/jpeg"),
+    "jpeg": ("jpg", ".jpg", "image/jpeg"),
+}
+
+ICON_ROOT = os.path.join(DIAGRAMS_ROOT, "resources")
+ICON_MEDIA_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.svg': 'image/svg+xml'}
+
+HREF_PATTERN = re.compile(rb'xlink:href="([^"]+)"')
+
+@functools.lru_cache(maxsize=1024)
+def _icon_data_uri(path: bytes):
+    real_path = os.path.realpath(path.decode('utf-8', errors='replace'))
+    media_type = ICON_MEDIA_TYPES.get(os.path.splitext(real_path)[1].lower())
+    # Only icons shipped with diagrams are inlined, never arbitrary files the code pointed at
+    if media_type is None or not real_path.startswith(ICON_ROOT + os.sep):
+        return None
+    try:
+        with open(real_path, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+    return f"data:{media_type};base64,".encode() + base64.b64encode(data)
+
+def embed_icons(svg: bytes) -> bytes:
+    """Inline the icon files Graphviz links to by path, so the SVG renders anywhere (including in <img>)."""
+    def replace(match):
+        uri = _icon_data_uri(match.group(1))
+        return b'xlink:href="' + uri + b'"' if uri is not None else match.group(0)
+    return HREF_PATTERN.sub(replace, svg)
+
+class DerivativeStore:
+    """DOT sources of SVG artifacts and the raster variants rendered from them on first request.
+
+    Objects are stored in the backend as ab/<digest>.gv and ab/<digest>.<variant>.<ext>,
+    so a variant can be derived by any worker sharing it. Concurrent requests for
+    the same missing variant wait for one render instead of each starting their own.
+    Renders take one of the render slots diagram renders use, and run under the render rlimits.
+    """
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+        # key -> [lock, number of callers using it]; also guards the counters
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.hits = 0
+
+    @staticmethod
+    def _key(digest: str, suffix: str) -> str:
+        return f"{digest[:2]}/{digest}{suffix}"
+
+    def put_source(self, digest: str, dot_source: bytes):
+        """Keep the DOT source an SVG artifact was rendered from."""
+        self.backend.put(self._key(digest, ".gv"), dot_source, content_type="text/vnd.graphviz")
+
+    def get_source(self, digest: str):
+        """Return the DOT source of an SVG artifact, or None if it is unknown or expired."""
+        return self.backend.get(self._key(digest, ".gv"))
+
+    def refresh_source(self, digest: str) -> bool:
+        """Restart the source's expiry while its SVG is still in use; returns whether it still exists."""
+        return self.backend.refresh(self._key(digest, ".gv"))
+
+    def _acquire_key_lock(self, key: str) -> list:
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry
+
+    def _release_key_lock(self, key: str, entry: list):
+        # Only dropped once no caller holds or waits on it, so every caller for key shares one lock
+        with self._lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, digest: str, output_format: str, variant: str):
+        """Return the variant's bytes, rendering it on first use; None if the source is gone."""
+        renderer, extension, media_type = FORMATS[output_format]
+        key = self._key(digest, f".{variant}{extension}")
+        data = self.backend.get(key)
+        if data is not None:
+            self._count('hits')
+            return data
+
+        entry = self._acquire_key_lock(key)
+        try:
+            with entry[0]:
+                data = self.backend.get(key)
+                if data is not None:
+                    self._count('hits')
+                    return data
+                source = self.get_source(digest)
+                if source is None:
+                    return None
+                # Requests run on the web server's threadpool, which has more threads than cores
+                with render_slots:
+                    data = render_dot(source.decode('utf-8'), renderer, VARIANTS[variant])
+                self.backend.put(key, data, content_type=media_type)
+                self._count('renders')
+                return data
+        finally:
+            self._release_key_lock(key, entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'derivative_renders': self.renders,
+                'derivative_hits': self.hits,
+            }
+
+derivative_store = DerivativeStore(derivative_backend)
@@ -1,117 +1,370 @@
 # diagram_service.py
 
-import openai
+import asyncio
+import contextvars
+import functools
+import json
 import os
-from backend.config import llm2
-from backend.app.utils.helpers import load_aws_services, get_icons_by_categories
-from autogen import ConversableAgent
-from autogen.coding import LocalCommandLineCodeExecutor
-import uuid
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from backend.config import (
+    llm2_spec_schema, LLM_MODEL, BASE_DIR, RENDER_MAX_WORKERS, RENDER_POOL_SIZE, RENDER_TIMEOUT,
+    DIAGRAM_OUTPUT_MODES, DIAGRAM_OUTPUT_MODE, RENDER_OUTPUT_FORMAT, PIPELINE_MODE,
+    RENDER_LIMITS,
+)
+from backend.app.utils.helpers import extract_python_code, split_diagrams
+from backend.app.services.llm_client import chat_completion, stream_chat_completion
+from backend.app.services.architecture_diagram import ArchitectureService
+from backend.app.services.llm_cache import llm_cache
+from backend.app.services.prompt_compiler import prompt_compiler, DIAGRAM_TEMPLATES
+from backend.app.services.renderer_pool import RendererPool, RenderError, limit_error, render_slots
+from backend.app.services.icon_catalog import icon_catalog
+from backend.app.services.code_validator import validate_diagram_code
+from backend.app.services.artifact_store import artifact_store
+from backend.app.services.derivative_store import derivative_store, embed_icons
+from backend.app.services.render_cache import render_cache
+from backend.app.services.layout_cache import layout_cache
+from backend.app.services.metrics import metrics
+from backend.app.services.single_flight import diagram_flights, render_flights
+from backend.app.services.graph_spec import (
+    load_spec, is_graph_spec, validate_spec, diagram_errors, compile_diagram, render_dot, GraphvizError,
+)
+
+renderer_pool = RendererPool(
+    size=RENDER_POOL_SIZE,
+    timeout=RENDER_TIMEOUT,
+    modules=icon_catalog.diagram_modules(),
+    output_format=RENDER_OUTPUT_FORMAT,
+    limits=RENDER_LIMITS,
+)
+
+# Per-render scratch directories are created under these roots
+CODE_EXE_DIR = os.path.join(BASE_DIR, 'code_exe')
+UPDATED_CODE_DIR = os.path.join(BASE_DIR, 'updated_code_files')
+
+# Renders block on a subprocess, so they run here instead of on the event loop
+_render_executor = ThreadPoolExecutor(max_workers=RENDER_MAX_WORKERS, thread_name_prefix="render")
 
 class DiagramService:
     @staticmethod
-    def generate_diagram(architecture: dict, cloud_provider: str) -> str:
-        services = load_aws_services(f'{cloud_provider}.yaml')
-        icons = get_icons_by_categories(services, architecture['icon_category_list'])
-        prompt = llm2.format(
-            icon_list=icons, 
-            project_description=architecture['architectural_description'],
-            cloud_provider=cloud_provider
+    def output_mode(mode: str = None) -> str:
+        """Resolve the requested diagram output mode, defaulting to DIAGRAM_OUTPUT_MODE."""
+        mode = mode or DIAGRAM_OUTPUT_MODE
+        if mode not in DIAGRAM_OUTPUT_MODES:
+            raise ValueError(f"Unsupported output mode: {mode}; expected one of {', '.join(DIAGRAM_OUTPUT_MODES)}")
+        return mode
+
+    @staticmethod
+    def _diagram_cache_key(architecture: dict, cloud_provider: str, mode: str) -> str:
+        return llm_cache.make_key(
+            "diagram",
+            json.dumps([architecture['architectural_description'], architecture['icon_category_list']]),
+            cloud_provider,
+            LLM_MODEL,
+            DIAGRAM_TEMPLATES[mode],
         )
-        print(f"\n\n\nPrompt: {prompt}")
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+
+    @staticmethod
+    def _diagram_prompt(architecture: dict, cloud_provider: str, mode: str):
+        with metrics.timed("icon_lookup"):
+            icons = icon_catalog.get_icons_by_categories(cloud_provider, architecture['icon_category_list'])
+        prompt = prompt_compiler.diagram_prompt(
+            cloud_provider, icons, architecture['architectural_description'], mode
+        )
+        print(f"Diagram prompt tokens: {prompt.tokens} ({prompt.dropped_icons} icons trimmed)")
+        return prompt
+
+    @staticmethod
+    def _diagram_request(prompt, mode: str) -> dict:
+        request = {
+            "model": LLM_MODEL,
+            "messages": [
                 {"role": "system", "content": "Here is Your Task"},
-                {"role": "user", "content": prompt}
-            ]
+                {"role": "user", "content": prompt.text}
+            ],
+        }
+        if mode == "spec":
+            request["response_format"] = {"type": "json_schema", "json_schema": llm2_spec_schema}
+        return request
+
+    @staticmethod
+    def _record_usage(cloud_provider: str, diagram_code: str):
+        spec = load_spec(diagram_code) if is_graph_spec(diagram_code) else None
+        if spec is None:
+            prompt_compiler.record_usage(cloud_provider, diagram_code)
+            return
+        prompt_compiler.record_icons(cloud_provider, [
+            node.get('icon') for diagram in spec['diagrams'] if isinstance(diagram, dict)
+            for node in diagram.get('nodes', []) if isinstance(node, dict) and node.get('provider') == cloud_provider
+        ])
+
+    @staticmethod
+    async def generate_diagram(architecture: dict, cloud_provider: str, mode: str = None) -> str:
+        """Return the diagram code, or the graph spec JSON in spec mode."""
+        mode = DiagramService.output_mode(mode)
+        cache_key = DiagramService._diagram_cache_key(architecture, cloud_provider, mode)
+        # Identical requests in flight at the same time share one llm2 call
+        return await diagram_flights.run(
+            cache_key,
+            lambda: DiagramService._generate_diagram(cache_key, architecture, cloud_provider, mode),
+        )
+
+    @staticmethod
+    async def _generate_diagram(cache_key: str, architecture: dict, cloud_provider: str, mode: str) -> str:
+        cached = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+        prompt = DiagramService._diagram_prompt(architecture, cloud_provider, mode)
+        response = await chat_completion(
+            "diagram",
+            prompt.tokens,
+            **DiagramService._diagram_request(prompt, mode),
         )
         diagram_code = response.choices[0].message.content
+        DiagramService._record_usage(cloud_provider, diagram_code)
+        await asyncio.to_thread(llm_cache.set, cache_key, "diagram", diagram_code)
         return diagram_code
 
     @staticmethod
-    def execute_code_and_get_images(diagram_code: str) -> list:
-        BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../"))
-        execution_dir = os.path.join(BASE_DIR, 'code_exe')
-        os.makedirs(execution_dir, exist_ok=True)
+    async def stream_diagram(architecture: dict, cloud_provider: str, mode: str = None):
+        """Yield the diagram code (or graph spec JSON) in chunks as the LLM produces them."""
+        mode = DiagramService.output_mode(mode)
+        cache_key = DiagramService._diagram_cache_key(architecture, cloud_provider, mode)
+        cached = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached is not None:
+            yield cached
+            return
 
-        unique_id = uuid.uuid4().hex
+        prompt = DiagramService._diagram_prompt(architecture, cloud_provider, mode)
+        chunks = []
+        async for delta in stream_chat_completion(
+            "diagram",
+            prompt.tokens,
+            **DiagramService._diagram_request(prompt, mode),
+        ):
+            chunks.append(delta)
+            yield delta
+        diagram_code = "".join(chunks)
+        DiagramService._record_usage(cloud_provider, diagram_code)
+        await asyncio.to_thread(llm_cache.set, cache_key, "diagram", diagram_code)
 
-        # Write the generated code to a file in 'code_exe' directory
-        code_file_path = os.path.join(execution_dir, f'generated_diagram_{unique_id}.py')
-        with open(code_file_path, 'w') as file:
-            file.write(diagram_code)
+    @staticmethod
+    async def generate_architecture_and_diagram(project_description: str, cloud_provider: str, mode: str = None) -> tuple:
+        """Run llm1 and llm2 as configured by PIPELINE_MODE; returns (architecture, diagram_code)."""
+        if PIPELINE_MODE != "pipelined":
+            architecture = await ArchitectureService.process_project_description(project_description, cloud_provider)
+            return architecture, await DiagramService.generate_diagram(architecture, cloud_provider, mode)
 
-        # Set up the code executor
-        executor = LocalCommandLineCodeExecutor(
-            timeout=30,  # Increased timeout for diagram generation
-            work_dir=execution_dir,
-        )
+        diagram_task = None
+        architecture = None
+        try:
+            async for event, value in ArchitectureService.stream_project_description(project_description, cloud_provider):
+                if event == "categories":
+                    # llm2 gets the description llm1 is analysing instead of waiting for llm1's rewrite of it
+                    seed = {'architectural_description': project_description, 'icon_category_list': value}
+                    diagram_task = asyncio.create_task(DiagramService.generate_diagram(seed, cloud_provider, mode))
+                else:
+                    architecture = value
+            return architecture, await diagram_task
+        except BaseException:
+            if diagram_task is not None:
+                diagram_task.cancel()
+            raise
 
-        # Create a ConversableAgent for code execution
-        code_executor_agent = ConversableAgent(
-            "code_executor_agent",
-            llm_config=False,
-            code_execution_config={"executor": executor},
-            human_input_mode=None,
-        )
+    @staticmethod
+    async def iter_renders(diagram_code: str, scratch_root: str):
+        """Render each diagram of diagram_code concurrently, yielding (index, result) as each finishes.
 
-        # Execute the generated code
-        reply = code_executor_agent.generate_reply(messages=[{"role": "user", "content": diagram_code}])
-        print(reply)
-
-        # Collect all image files in 'code_exe' directory
-        image_extensions = ['.png', '.jpg', '.jpeg', '.svg']
-        images = [
-            f"/images/{file}"
-            for file in os.listdir(execution_dir)
-            if os.path.splitext(file)[1].lower() in image_extensions
-        ]
-
-        return images
-    
-    @staticmethod
-    def execute_updated_code_and_get_images(diagram_code: str) -> list:
-        BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../"))
-        execution_dir = os.path.join(BASE_DIR, 'updated_code_files')
-        os.makedirs(execution_dir, exist_ok=True)
-
-        unique_id = uuid.uuid4().hex
-
-        # Write the code to a file in 'updated_code_files' directory
-        code_file_path = os.path.join(execution_dir, f'generated_diagram_{unique_id}.py')
-        with open(code_file_path, 'w') as file:
-            file.write(diagram_code)
-
-        # Set up the code executor
-        executor = LocalCommandLineCodeExecutor(
-            timeout=30,
-            work_dir=execution_dir,
-        )
+        Each diagram is cached on its own, so after an edit only the diagrams
+        whose code changed are rendered again. diagram_code may also be a graph
+        spec, whose diagrams are compiled to DOT instead.
+        """
+        loop = asyncio.get_running_loop()
+        spec = load_spec(diagram_code) if is_graph_spec(diagram_code) else None
+        if spec is not None:
+            errors = validate_spec(spec)
+            if errors:
+                yield 0, {'images': [], 'error': "Invalid graph spec: " + "; ".join(errors[:5])}
+                return
+            units, render_unit = spec['diagrams'], DiagramService.render_spec_diagram
+            # Canonical JSON, so key order and formatting of the edited spec don't matter
+            unit_keys = [json.dumps(diagram, sort_keys=True) for diagram in units]
+            unit_errors = [diagram_errors(diagram, index) for index, diagram in enumerate(units)]
+        else:
+            units = split_diagrams(diagram_code)
+            render_unit = functools.partial(DiagramService.render_in_scratch_dir, scratch_root=scratch_root)
+            unit_keys = units
+            unit_errors = [[] for _ in units]
 
-        # Create a ConversableAgent for code execution
-        code_executor_agent = ConversableAgent(
-            "code_executor_agent",
-            llm_config=False,
-            code_execution_config={"executor": executor},
-            human_input_mode=None,
-        )
+        def render_in_slot(unit):
+            # Shared with derivative renders, which don't go through _render_executor
+            with render_slots:
+                return render_unit(unit)
 
-        # Execute the generated code
+        async def render_and_cache(unit_key: str, unit):
+            # run_in_executor doesn't carry context over, which the request's stage timings live in
+            context = contextvars.copy_context()
+            result = await loop.run_in_executor(_render_executor, context.run, render_in_slot, unit)
+            # Failed renders are not cached so that fixing the diagram re-renders it
+            if not result['error']:
+                await asyncio.to_thread(render_cache.put, unit_key, result['images'])
+            return result
+
+        async def render(index: int, unit):
+            if unit_errors[index]:
+                return index, {'images': [], 'error': "Invalid graph spec: " + "; ".join(unit_errors[index][:5])}
+            cached = await asyncio.to_thread(render_cache.get, unit_keys[index])
+            if cached is not None:
+                return index, {'images': cached, 'error': None}
+            # The same diagram rendered by concurrent requests runs as one job
+            result = await render_flights.run(unit_keys[index], lambda: render_and_cache(unit_keys[index], unit))
+            return index, result
+
+        for next_done in asyncio.as_completed([render(index, unit) for index, unit in enumerate(units)]):
+            yield await next_done
+
+    @staticmethod
+    async def render_all(diagram_code: str, scratch_root: str) -> tuple:
+        """Render every diagram and return (images, errors) in diagram order."""
+        results = {}
+        async for index, result in DiagramService.iter_renders(diagram_code, scratch_root):
+            results[index] = result
+
+        images = []
+        errors = []
+        for index in sorted(results):
+            images.extend(results[index]['images'])
+            if results[index]['error']:
+                errors.append({'diagram': index + 1, 'error': results[index]['error']})
+        return images, errors
+
+    @staticmethod
+    async def render_images(diagram_code: str) -> tuple:
+        """Render the diagrams of generated code; returns (images, errors)."""
+        return await DiagramService.render_all(diagram_code, CODE_EXE_DIR)
+
+    @staticmethod
+    async def render_updated_images(diagram_code: str) -> tuple:
+        """Render edited code, reusing the images of unchanged diagrams; returns (images, errors)."""
+        return await DiagramService.render_all(diagram_code, UPDATED_CODE_DIR)
+
+    @staticmethod
+    def start_renderer_pool():
+        """Spawn the warm renderer workers so the first request doesn't pay for it."""
+        renderer_pool.start()
+
+    @staticmethod
+    def shutdown_executor():
+        """Stop accepting renders, wait for in-flight ones and stop the renderer workers."""
+        _render_executor.shutdown(wait=True)
+        renderer_pool.shutdown()
+
+    @staticmethod
+    def render_in_scratch_dir(diagram_code: str, scratch_root: str) -> dict:
+        """Render into a private scratch directory and move the images into the artifact store.
+
+        Returns a dict with the artifact keys under 'images' and a short
+        description of the failure under 'error' (None on success).
+        """
+        # Reject or repair bad code in-process before paying for a renderer job
+        with metrics.timed("validate"):
+            validation = validate_diagram_code(extract_python_code(diagram_code))
+        for rewrite in validation.rewrites:
+            print(f"Rewrote diagram code: {rewrite}")
+        if not validation.ok:
+            return {'images': [], 'error': "; ".join(validation.errors)}
+
+        os.makedirs(scratch_root, exist_ok=True)
+        scratch_dir = tempfile.mkdtemp(prefix='render_', dir=scratch_root)
         try:
-            reply = code_executor_agent.generate_reply(
-                messages=[{"role": "user", "content": diagram_code}]
+            # Keep the submitted code next to its output for debugging
+            with metrics.timed("code_write"):
+                with open(os.path.join(scratch_dir, 'generated_diagram.py'), 'w') as file:
+                    file.write(diagram_code)
+
+            try:
+                with metrics.timed("render"):
+                    result = renderer_pool.render(validation.code, scratch_dir)
+            except RenderError as e:
+                print("Error executing diagram code:", str(e))
+                return {'images': [], 'error': str(e)}
+            print(result['output'])
+
+            with metrics.timed("image_store"):
+                images = DiagramService._store_images(result['images'], result['sources'])
+            error = DiagramService._render_error(result, images)
+            for stage, seconds in result['timings'].items():
+                metrics.observe(stage, seconds, "error" if error else "success")
+            layout_cache.record(RENDER_OUTPUT_FORMAT, result['layout_cache']['hit'], result['layout_cache']['miss'])
+            if result['usage'] is not None:
+                limit = 'timeout' if result['timed_out'] else result['limit_exceeded']
+                metrics.observe_render_usage(result['usage']['cpu_seconds'], result['usage']['max_rss_bytes'], limit)
+                if limit is not None:
+                    print(f"Render job exceeded its {limit} budget: {result['usage']['cpu_seconds']:.1f}s CPU, "
+                          f"{result['usage']['max_rss_bytes'] // (1024 * 1024)} MiB peak RSS")
+            return {'images': images, 'error': error}
+        finally:
+            with metrics.timed("cleanup"):
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    @staticmethod
+    def render_spec_diagram(diagram: dict) -> dict:
+        """Compile one graph spec diagram to DOT and render it with Graphviz, without running any Python."""
+        with metrics.timed("spec_compile"):
+            compiled = compile_diagram(diagram)
+        for rewrite in compiled.rewrites:
+            print(f"Rewrote graph spec icon: {rewrite}")
+        if not compiled.ok:
+            return {'images': [], 'error': "; ".join(compiled.errors)}
+        key = layout_cache.key_for(compiled.dot, RENDER_OUTPUT_FORMAT)
+        cached = layout_cache.get(key, RENDER_OUTPUT_FORMAT)
+        if cached is not None:
+            data, source = cached
+        else:
+            source = compiled.dot.encode('utf-8')
+            try:
+                with metrics.timed("graphviz"):
+                    data = render_dot(compiled.dot, RENDER_OUTPUT_FORMAT)
+            except GraphvizError as e:
+                print("Error rendering graph spec:", str(e))
+                return {'images': [], 'error': str(e)}
+            layout_cache.put(key, RENDER_OUTPUT_FORMAT, data, source)
+        layout_cache.record(RENDER_OUTPUT_FORMAT, [key] if cached is not None else [], [key] if cached is None else [])
+        with metrics.timed("image_store"):
+            images = DiagramService._store_images(
+                [{'name': f"diagram.{RENDER_OUTPUT_FORMAT}", 'data': data}],
+                [{'name': "diagram.gv", 'data': source}],
             )
-            print(reply)
-        except Exception as e:
-            print("Error executing diagram code:", str(e))
-            raise
+        return {'images': images, 'error': None}
 
-        # Collect all image files in 'updated_code_files' directory
-        image_extensions = ['.png', '.jpg', '.jpeg', '.svg']
-        images = [
-            file
-            for file in os.listdir(execution_dir)
-            if os.path.splitext(file)[1].lower() in image_extensions
-        ]
-        return images
\ No newline at end of file
+    @staticmethod
+    def _store_images(images: list, sources: list) -> list:
+        """Put rendered images into the artifact store, keeping the DOT source of SVGs for raster variants."""
+        sources_by_stem = {os.path.splitext(source['name'])[0]: source['data'] for source in sources}
+        keys = []
+        for image in images:
+            stem, extension = os.path.splitext(image['name'])
+            if extension.lower() != '.svg':
+                keys.append(artifact_store.put_bytes(image['data'], extension))
+                continue
+            key = artifact_store.put_bytes(embed_icons(image['data']), extension)
+            source = sources_by_stem.get(stem)
+            if source is not None:
+                derivative_store.put_source(artifact_store.digest(key), source)
+            keys.append(key)
+        return keys
+
+    @staticmethod
+    def _render_error(result: dict, images: list):
+        if result['timed_out']:
+            return f"Rendering timed out after {RENDER_TIMEOUT:g} seconds"
+        if result['limit_exceeded'] is not None:
+            return limit_error(result['limit_exceeded'], RENDER_LIMITS)
+        if result['exit_code'] != 0:
+            lines = result['output'].strip().splitlines()
+            return lines[-1] if lines else f"Diagram code exited with status {result['exit_code']}"
+        if not images:
+            return "Diagram code did not produce any images"
+        return None
@@ -0,0 +1,135 @@
+# expiry_manager.py
+
+import heapq
+import os
+import threading
+import time
+
+from backend.config import ARTIFACT_TTL
+
+class ExpiryManager:
+    """Deletes tracked files once their TTL has passed.
+
+    Expiry times are kept in a min-heap, so scheduling is O(log n) and the
+    single reaper thread only wakes up when the earliest file is due. A file
+    tracked again (for example a content-addressed image that was re-rendered)
+    gets a later expiry; the stale heap entry is skipped when it surfaces.
+
+    Other processes sharing the directory keep their own heaps, so before
+    deleting a file the reaper checks its mtime: a file rewritten or touched
+    elsewhere within its TTL is rescheduled instead.
+    """
+
+    def __init__(self, default_ttl: float):
+        self.default_ttl = default_ttl
+        self._heap = []
+        self._expiry = {}
+        self._ttls = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.files_reclaimed = 0
+        self.bytes_reclaimed = 0
+        self.failures = 0
+
+    def track(self, path: str, ttl: float = None, expires_at: float = None):
+        """Schedule path for deletion ttl seconds from now (or at expires_at)."""
+        ttl = self.default_ttl if ttl is None else ttl
+        if expires_at is None:
+            expires_at = time.time() + ttl
+        with self._condition:
+            self._expiry[path] = expires_at
+            self._ttls[path] = ttl
+            heapq.heappush(self._heap, (expires_at, path))
+            if self._heap[0][1] == path:
+                self._condition.notify()
+
+    def track_existing(self, directory: str, ttl: float = None):
+        """Register files left from a previous run, expiring them relative to their mtime."""
+        ttl = self.default_ttl if ttl is None else ttl
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    self.track(path, ttl=ttl, expires_at=os.path.getmtime(path) + ttl)
+                except OSError:
+                    pass
+
+    def _pop_expired(self) -> list:
+        now = time.time()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, path = heapq.heappop(self._heap)
+            # Skip entries superseded by a later track() of the same path
+            if self._expiry.get(path) == expires_at:
+                del self._expiry[path]
+                expired.append((path, self._ttls.pop(path)))
+        return expired
+
+    def _delete(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            self.failures += 1
+            print(f"Failed to delete {path}. Reason: {e}")
+            return
+        self.files_reclaimed += 1
+        self.bytes_reclaimed += size
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopping:
+                    expired = self._pop_expired()
+                    if expired:
+                        break
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopping:
+                    return
+            for path, ttl in expired:
+                with self._condition:
+                    # Tracked again after it was popped, e.g. re-rendered content
+                    if path in self._expiry:
+                        continue
+                    try:
+                        expires_at = os.stat(path).st_mtime + ttl
+                    except FileNotFoundError:
+                        continue
+                    if expires_at > time.time():
+                        # Rewritten or refreshed by another process sharing the directory
+                        self.track(path, ttl=ttl, expires_at=expires_at)
+                        continue
+                    self._delete(path)
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="expiry-manager", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'tracked_files': len(self._expiry),
+                'files_reclaimed': self.files_reclaimed,
+                'bytes_reclaimed': self.bytes_reclaimed,
+                'failures': self.failures,
+                'next_expiry_in': max(self._heap[0][0] - time.time(), 0) if self._heap else None,
+            }
+
+expiry_manager = ExpiryManager(ARTIFACT_TTL)
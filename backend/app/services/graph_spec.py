@@ -0,0 +1,289 @@
+# graph_spec.py
+
+import functools
+import importlib
+import json
+import os
+import re
+
+import diagrams
+from backend.config import llm2_spec_schema, GRAPHVIZ_DOT, RENDER_TIMEOUT, RENDER_LIMITS
+from backend.app.services.code_validator import closest_icon
+from backend.app.services.icon_catalog import icon_catalog
+from backend.app.services.metrics import metrics
+from backend.app.services.renderer_pool import run_limited, limit_error
+from backend.app.utils.helpers import CODE_BLOCK_PATTERN
+
+# Mirrors the defaults of diagrams.Diagram, Cluster, Node and Edge so both modes look alike
+GRAPH_ATTRS = {
+    "pad": "2.0",
+    "splines": "ortho",
+    "nodesep": "0.60",
+    "ranksep": "0.75",
+    "fontname": "Sans-Serif",
+    "fontsize": "15",
+    "fontcolor": "#2D3436",
+}
+NODE_ATTRS = {
+    "shape": "box",
+    "style": "rounded",
+    "fixedsize": "true",
+    "width": "1.4",
+    "height": "1.4",
+    "labelloc": "b",
+    "imagescale": "true",
+    "fontname": "Sans-Serif",
+    "fontsize": "13",
+    "fontcolor": "#2D3436",
+}
+EDGE_ATTRS = {
+    "color": "#7B8894",
+    "fontcolor": "#2D3436",
+    "fontname": "Sans-Serif",
+    "fontsize": "13",
+}
+CLUSTER_ATTRS = {
+    "shape": "box",
+    "style": "rounded",
+    "labeljust": "l",
+    "pencolor": "#AEB6BE",
+    "fontname": "Sans-Serif",
+    "fontsize": "12",
+}
+CLUSTER_BGCOLORS = ("#E5F5FD", "#EBF3E7", "#ECE8F6", "#FDF7E3")
+ICON_NODE_HEIGHT = 1.9
+
+# Provider and category become a module path, so they must be plain identifiers
+IDENTIFIER_PATTERN = re.compile(r"^[a-z0-9_]+$")
+
+DIAGRAMS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(diagrams.__file__)))
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "null": type(None),
+}
+
+class CompiledGraph:
+    def __init__(self, dot: str, errors: list, rewrites: list):
+        self.dot = dot
+        self.errors = errors
+        self.rewrites = rewrites
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+def load_spec(text: str):
+    """Parse a graph spec from an LLM reply or edited text; None if it isn't one."""
+    candidates = [text] + [code for _, code in CODE_BLOCK_PATTERN.findall(text)]
+    for candidate in candidates:
+        try:
+            spec = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(spec, dict) and isinstance(spec.get('diagrams'), list):
+            return spec
+    return None
+
+def is_graph_spec(text: str) -> bool:
+    # Cheap check first; diagram code never starts with a brace
+    stripped = text.lstrip()
+    return (stripped.startswith('{') or stripped.startswith('```json')) and load_spec(text) is not None
+
+def schema_errors(value, schema: dict, path: str = "spec") -> list:
+    """Check value against the subset of JSON Schema that llm2_spec_schema uses."""
+    types = schema.get('type')
+    if types is not None:
+        types = [types] if isinstance(types, str) else types
+        if not any(isinstance(value, _JSON_TYPES[name]) for name in types):
+            return [f"{path}: expected {' or '.join(types)}"]
+    if 'enum' in schema and value not in schema['enum']:
+        return [f"{path}: must be one of {', '.join(schema['enum'])}"]
+    errors = []
+    if isinstance(value, dict):
+        properties = schema.get('properties', {})
+        for name in schema.get('required', []):
+            if name not in value:
+                errors.append(f"{path}: missing '{name}'")
+        for name, item in value.items():
+            if name in properties:
+                errors.extend(schema_errors(item, properties[name], f"{path}.{name}"))
+            elif schema.get('additionalProperties') is False:
+                errors.append(f"{path}: unexpected '{name}'")
+    elif isinstance(value, list) and 'items' in schema:
+        for index, item in enumerate(value):
+            errors.extend(schema_errors(item, schema['items'], f"{path}[{index}]"))
+    return errors
+
+# Diagrams are checked one by one, so one malformed diagram doesn't fail the others
+_DIAGRAM_SCHEMA = llm2_spec_schema['schema']['properties']['diagrams']['items']
+_ENVELOPE_SCHEMA = {
+    **llm2_spec_schema['schema'],
+    'properties': {
+        **llm2_spec_schema['schema']['properties'],
+        'diagrams': {'type': 'array'},
+    },
+}
+
+def validate_spec(spec: dict) -> list:
+    """Check everything but the diagrams themselves, which diagram_errors checks."""
+    return schema_errors(spec, _ENVELOPE_SCHEMA)
+
+def diagram_errors(diagram, index: int) -> list:
+    return schema_errors(diagram, _DIAGRAM_SCHEMA, f"spec.diagrams[{index}]")
+
+@functools.lru_cache(maxsize=None)
+def icon_images(provider: str, category: str) -> dict:
+    """Map each node class of diagrams.<provider>.<category> to its icon image path."""
+    if not (IDENTIFIER_PATTERN.match(provider) and IDENTIFIER_PATTERN.match(category)):
+        return {}
+    try:
+        module = importlib.import_module(f"diagrams.{provider}.{category}")
+    except ImportError:
+        return {}
+    return {
+        name: os.path.join(DIAGRAMS_ROOT, value._icon_dir, value._icon)
+        for name, value in vars(module).items()
+        if isinstance(value, type) and not name.startswith('_') and getattr(value, '_icon', None)
+    }
+
+def resolve_icon(provider: str, category: str, icon: str):
+    """Return (image path, rewrite note) for an icon, fixing near-miss names; path is None if unknown."""
+    images = icon_images(provider, category)
+    if icon in images:
+        return images[icon], None
+    match = closest_icon(icon, list(images))
+    if match is not None:
+        return images[match], f"{provider}.{category}.{icon} -> {provider}.{category}.{match}"
+    # The icon may exist under another category of the same provider
+    for _, located_category in icon_catalog.locate(icon, provider):
+        images = icon_images(provider, located_category)
+        if icon in images:
+            return images[icon], f"{provider}.{category}.{icon} -> {provider}.{located_category}.{icon}"
+    return None, None
+
+def quote(value: str) -> str:
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'"{escaped}"'
+
+def attributes(attrs: dict) -> str:
+    return ", ".join(f"{name}={quote(value)}" for name, value in attrs.items())
+
+def compile_diagram(diagram: dict) -> CompiledGraph:
+    """Compile one diagram of a validated graph spec to DOT source."""
+    errors, rewrites = [], []
+    clusters = {}
+    for cluster in diagram['clusters']:
+        if cluster['id'] in clusters:
+            errors.append(f"duplicate cluster id '{cluster['id']}'")
+        clusters[cluster['id']] = cluster
+    children = {}
+    for cluster in clusters.values():
+        parent = cluster['parent']
+        if parent is not None and parent not in clusters:
+            errors.append(f"cluster '{cluster['id']}' has unknown parent '{parent}'")
+            parent = None
+        children.setdefault(parent, []).append(cluster['id'])
+
+    node_lines = {}
+    members = {}
+    for node in diagram['nodes']:
+        if node['id'] in node_lines:
+            errors.append(f"duplicate node id '{node['id']}'")
+            continue
+        image, rewrite = resolve_icon(node['provider'], node['category'], node['icon'])
+        if image is None:
+            errors.append(f"'{node['icon']}' is not a valid icon in diagrams.{node['provider']}.{node['category']}")
+            continue
+        if rewrite:
+            rewrites.append(rewrite)
+        if node['cluster'] is not None and node['cluster'] not in clusters:
+            errors.append(f"node '{node['id']}' is in unknown cluster '{node['cluster']}'")
+            continue
+        padding = 0.4 * node['label'].count('\n')
+        attrs = {
+            'label': node['label'],
+            'shape': 'none',
+            'height': str(ICON_NODE_HEIGHT + padding),
+            'image': image,
+        }
+        node_lines[node['id']] = f"{quote(node['id'])} [{attributes(attrs)}]"
+        members.setdefault(node['cluster'], []).append(node['id'])
+
+    edge_lines = []
+    for edge in diagram['edges']:
+        missing = [end for end in (edge['source'], edge['target']) if end not in node_lines]
+        if missing:
+            errors.append(f"edge {edge['source']} -> {edge['target']} references unknown node '{missing[0]}'")
+            continue
+        attrs = {'dir': edge['direction']}
+        if edge['label']:
+            attrs['label'] = edge['label']
+        if edge['style'] != 'solid':
+            attrs['style'] = edge['style']
+        edge_lines.append(f"{quote(edge['source'])} -> {quote(edge['target'])} [{attributes(attrs)}]")
+
+    graph_attrs = {**GRAPH_ATTRS, 'label': diagram['name'], 'rankdir': diagram['direction']}
+    lines = [
+        f"digraph {quote(diagram['name'])} {{",
+        f"graph [{attributes(graph_attrs)}]",
+        f"node [{attributes(NODE_ATTRS)}]",
+        f"edge [{attributes(EDGE_ATTRS)}]",
+    ]
+    lines.extend(node_lines[node_id] for node_id in members.get(None, []))
+
+    emitted = set()
+    def emit_cluster(cluster_id: str, depth: int):
+        emitted.add(cluster_id)
+        cluster = clusters[cluster_id]
+        lines.append(f"subgraph {quote('cluster_' + cluster_id)} {{")
+        attrs = {
+            **CLUSTER_ATTRS,
+            'label': cluster['label'],
+            'bgcolor': CLUSTER_BGCOLORS[depth % len(CLUSTER_BGCOLORS)],
+        }
+        lines.append(f"graph [{attributes(attrs)}]")
+        lines.extend(node_lines[node_id] for node_id in members.get(cluster_id, []))
+        for child in children.get(cluster_id, []):
+            emit_cluster(child, depth + 1)
+        lines.append("}")
+
+    for cluster_id in children.get(None, []):
+        emit_cluster(cluster_id, 0)
+    # Clusters never reached from the top level are parents of each other
+    for cluster_id in clusters:
+        if cluster_id not in emitted:
+            errors.append(f"cluster '{cluster_id}' is part of a parent cycle")
+            break
+
+    lines.extend(edge_lines)
+    lines.append("}")
+    return CompiledGraph("\n".join(lines) + "\n", errors, rewrites)
+
+class GraphvizError(Exception):
+    """Raised when Graphviz fails to lay out or render a graph."""
+
+def render_dot(dot: str, output_format: str = "png", options: tuple = ()) -> bytes:
+    """Lay out and render DOT source by piping it through the Graphviz dot executable.
+
+    dot runs under the same rlimits as pooled render jobs and its usage is
+    recorded alongside theirs.
+    """
+    try:
+        result = run_limited(
+            [GRAPHVIZ_DOT, f"-T{output_format}", *options], dot.encode('utf-8'), RENDER_TIMEOUT, RENDER_LIMITS
+        )
+    except FileNotFoundError:
+        raise GraphvizError(f"Graphviz executable '{GRAPHVIZ_DOT}' was not found")
+    limit = 'timeout' if result['timed_out'] else result['limit_exceeded']
+    metrics.observe_render_usage(result['usage']['cpu_seconds'], result['usage']['max_rss_bytes'], limit)
+    if result['timed_out']:
+        raise GraphvizError(f"Rendering timed out after {RENDER_TIMEOUT:g} seconds")
+    if result['limit_exceeded'] is not None:
+        raise GraphvizError(limit_error(result['limit_exceeded'], RENDER_LIMITS))
+    if result['exit_code'] != 0:
+        lines = result['output'].strip().splitlines()
+        raise GraphvizError(lines[-1] if lines else f"Graphviz exited with status {result['exit_code']}")
+    return result['stdout']
@@ -0,0 +1,93 @@
+# icon_catalog.py
+
+import json
+import os
+
+from backend.config import BASE_DIR, CLOUD_PROVIDERS, ICON_CATALOG_SNAPSHOT
+from backend.app.utils.helpers import load_aws_services
+
+class IconCatalog:
+    """Provider icon lists parsed once from <provider>.yaml and indexed for O(1) lookups.
+
+    The parsed catalog is written to a JSON snapshot that is reused as long as
+    the modification times of the YAML files it was built from are unchanged.
+    """
+
+    def __init__(self, yaml_dir: str, providers: tuple, snapshot_path: str):
+        self.yaml_dir = yaml_dir
+        self.providers = providers
+        self.snapshot_path = snapshot_path
+        self._categories = {}
+        self._icon_index = {}
+
+    def _yaml_path(self, provider: str) -> str:
+        return os.path.join(self.yaml_dir, f"{provider}.yaml")
+
+    def _source_mtimes(self) -> dict:
+        return {provider: os.stat(self._yaml_path(provider)).st_mtime_ns for provider in self.providers}
+
+    def _read_snapshot(self, sources: dict):
+        try:
+            with open(self.snapshot_path, 'r') as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if snapshot.get('sources') != sources:
+            return None
+        return snapshot['categories']
+
+    def _write_snapshot(self, sources: dict, categories: dict):
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        temporary_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump({'sources': sources, 'categories': categories}, file)
+        os.replace(temporary_path, self.snapshot_path)
+
+    def load(self):
+        sources = self._source_mtimes()
+        categories = self._read_snapshot(sources)
+        if categories is None:
+            categories = {
+                provider: {
+                    service['category']: service.get('icons', [])
+                    for service in load_aws_services(self._yaml_path(provider)) or []
+                }
+                for provider in self.providers
+            }
+            self._write_snapshot(sources, categories)
+
+        icon_index = {}
+        for provider, provider_categories in categories.items():
+            for category, icons in provider_categories.items():
+                for icon in icons:
+                    icon_index.setdefault(icon, []).append((provider, category))
+        self._categories = categories
+        self._icon_index = icon_index
+
+    def categories(self, provider: str) -> list:
+        return list(self._categories.get(provider, {}))
+
+    def icons(self, provider: str, category: str) -> list:
+        return self._categories.get(provider, {}).get(category, [])
+
+    def get_icons_by_categories(self, provider: str, categories: list) -> dict:
+        """Retrieve icons corresponding to the specified categories."""
+        return {category: self.icons(provider, category) for category in categories}
+
+    def locate(self, icon: str, provider: str = None) -> list:
+        """Return every (provider, category) pair that offers icon."""
+        locations = self._icon_index.get(icon, [])
+        if provider is not None:
+            return [location for location in locations if location[0] == provider]
+        return list(locations)
+
+    def diagram_modules(self) -> list:
+        """List the diagrams node modules backing the catalog, for renderer preloading."""
+        return [
+            f"diagrams.{provider}.{category}"
+            for provider, provider_categories in self._categories.items()
+            for category in provider_categories
+        ]
+
+icon_catalog = IconCatalog(BASE_DIR, CLOUD_PROVIDERS, ICON_CATALOG_SNAPSHOT)
+icon_catalog.load()
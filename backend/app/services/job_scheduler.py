@@ -0,0 +1,119 @@
+# job_scheduler.py
+
+import asyncio
+import time
+import uuid
+
+from backend.config import JOB_MAX_LLM_CONCURRENCY, JOB_MAX_RENDER_CONCURRENCY, JOB_QUEUE_DEPTH, JOB_RESULT_TTL
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its configured depth."""
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.timings = {}
+        self.created_at = time.time()
+        self.finished_at = None
+
+class JobScheduler:
+    """In-process scheduler that runs job pipelines with separate LLM and render concurrency caps.
+
+    A pipeline is an async function taking the Job; it wraps each unit of work
+    in run_stage so the stage waits for a slot of the given resource and its
+    wait and run times are recorded on the job.
+    """
+
+    def __init__(self, limits: dict, max_queue_depth: int, result_ttl: float):
+        self.limits = limits
+        self.max_queue_depth = max_queue_depth
+        self.result_ttl = result_ttl
+        self._slots = {resource: asyncio.Semaphore(limit) for resource, limit in limits.items()}
+        self._waiting = {resource: [] for resource in limits}
+        self._jobs = {}
+        self._tasks = set()
+
+    def queued_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == "queued")
+
+    def submit(self, kind: str, pipeline) -> Job:
+        self._purge_finished()
+        if self.queued_count() >= self.max_queue_depth:
+            raise QueueFullError(f"Job queue is full ({self.max_queue_depth} jobs waiting)")
+        job = Job(kind)
+        self._jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, pipeline))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def queue_position(self, job: Job):
+        """1-based position of the job among those waiting for the same resource, if waiting."""
+        for waiting in self._waiting.values():
+            if job.id in waiting:
+                return waiting.index(job.id) + 1
+        return None
+
+    async def run_stage(self, job: Job, stage: str, resource: str, work):
+        """Wait for a slot of resource, then await work() and record the stage timings."""
+        waiting = self._waiting[resource]
+        job.status = "queued"
+        job.stage = stage
+        waiting.append(job.id)
+        queued_at = time.monotonic()
+        try:
+            await self._slots[resource].acquire()
+        finally:
+            waiting.remove(job.id)
+        job.status = "running"
+        started_at = time.monotonic()
+        try:
+            return await work()
+        finally:
+            self._slots[resource].release()
+            job.timings[stage] = {
+                "wait_seconds": started_at - queued_at,
+                "run_seconds": time.monotonic() - started_at,
+            }
+
+    async def _run(self, job: Job, pipeline):
+        try:
+            job.result = await pipeline(job)
+            job.status = "succeeded"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.stage = None
+            job.finished_at = time.time()
+
+    def _purge_finished(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "jobs": len(self._jobs),
+            "queued": {resource: len(waiting) for resource, waiting in self._waiting.items()},
+            "limits": dict(self.limits),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+job_scheduler = JobScheduler(
+    {"llm": JOB_MAX_LLM_CONCURRENCY, "render": JOB_MAX_RENDER_CONCURRENCY},
+    JOB_QUEUE_DEPTH,
+    JOB_RESULT_TTL,
+)
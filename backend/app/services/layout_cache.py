@@ -0,0 +1,261 @@
+# layout_cache.py
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from backend.config import LAYOUT_CACHE_DIR, LAYOUT_CACHE_BYTES
+from backend.app.services.metrics import metrics
+
+# Statements of the DOT that diagrams and graph_spec emit: '<id> [attrs]' and '<id> -> <id> [attrs]'
+_ID = r'("(?:[^"\\]|\\.)*"|[A-Za-z0-9_]+)'
+NODE_PATTERN = re.compile(rf'^{_ID}(?: \[(.*)\])?$', re.DOTALL)
+EDGE_PATTERN = re.compile(rf'^{_ID} -> {_ID}(?: \[(.*)\])?$', re.DOTALL)
+
+# Attribute statements, not nodes
+_KEYWORDS = {'graph', 'node', 'edge'}
+
+def _statements(source: str) -> list:
+    """Split DOT source into statements: one per line, except for newlines inside quoted strings."""
+    statements, current = [], []
+    in_quotes = escaped = False
+    for char in source:
+        if in_quotes:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_quotes = False
+        elif char == '"':
+            in_quotes = True
+        elif char == '\n':
+            statements.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    statements.append(''.join(current).strip())
+    return [statement for statement in statements if statement]
+
+def _parse(source: str) -> dict:
+    """Parse DOT source into nested blocks of {'header', 'items'}, where items are statements or blocks."""
+    root = {'header': '', 'items': []}
+    stack = [root]
+    for statement in _statements(source):
+        if statement.endswith('{'):
+            block = {'header': statement, 'items': []}
+            stack[-1]['items'].append(block)
+            stack.append(block)
+        elif statement == '}' and len(stack) > 1:
+            stack.pop()
+        else:
+            stack[-1]['items'].append(statement)
+    return root
+
+def canonical_dot(source: str) -> str:
+    """Rewrite DOT source so that graphs differing only in node ids and statement order are equal.
+
+    diagrams names every node with a random uuid, so node ids are replaced by
+    names derived from each node's attributes, cluster and edges. Statements
+    within each block are then sorted.
+    """
+    root = _parse(source)
+    nodes, edges, first_seen = {}, [], {}
+
+    def collect(block: dict, path: tuple):
+        for item in block['items']:
+            if isinstance(item, dict):
+                collect(item, path + (item['header'],))
+                continue
+            edge = EDGE_PATTERN.match(item)
+            if edge is not None:
+                edges.append((edge.group(1), edge.group(2), edge.group(3) or ''))
+                continue
+            node = NODE_PATTERN.match(item)
+            if node is not None and node.group(1) not in _KEYWORDS:
+                nodes[node.group(1)] = repr((path, node.group(2) or ''))
+                first_seen.setdefault(node.group(1), len(first_seen))
+    collect(root, ())
+
+    # One round of refinement by neighbours tells apart nodes that look alike but connect differently
+    outgoing, incoming = {}, {}
+    for source_id, target, attrs in edges:
+        outgoing.setdefault(source_id, []).append((attrs, nodes.get(target, target)))
+        incoming.setdefault(target, []).append((attrs, nodes.get(source_id, source_id)))
+    signatures = {
+        node_id: repr((signature, sorted(outgoing.get(node_id, [])), sorted(incoming.get(node_id, []))))
+        for node_id, signature in nodes.items()
+    }
+    ordered = sorted(nodes, key=lambda node_id: (signatures[node_id], first_seen[node_id]))
+    names = {node_id: f"n{index}" for index, node_id in enumerate(ordered)}
+
+    def render(block: dict) -> str:
+        items = []
+        for item in block['items']:
+            if isinstance(item, dict):
+                items.append(render(item))
+                continue
+            edge = EDGE_PATTERN.match(item)
+            node = NODE_PATTERN.match(item)
+            if edge is not None:
+                item = f"{names.get(edge.group(1), edge.group(1))} -> {names.get(edge.group(2), edge.group(2))} [{edge.group(3) or ''}]"
+            elif node is not None and node.group(1) in names:
+                item = f"{names[node.group(1)]} [{node.group(2) or ''}]"
+            items.append(item)
+        return "\n".join([block['header'], *sorted(items), "}"])
+    return "\n".join(sorted(render(block) if isinstance(block, dict) else block for block in root['items']))
+
+class LayoutCache:
+    """Disk cache of Graphviz output keyed by the canonical form of the DOT source it was rendered from.
+
+    Entries live under <directory>/ab/<key>.<format> together with the DOT
+    source that produced them, so raster variants derived later match the
+    cached layout. Render children read and write entries directly and report
+    the keys they looked up; the API process keeps an LRU index of entry sizes,
+    built from one scan of the directory on first use, and evicts
+    least-recently-used entries once the tracked total exceeds max_bytes.
+    A max_bytes of 0 disables the cache.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (size, paths), least recently used first; None until first needed
+        self._index = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key_for(dot_source: str, output_format: str) -> str:
+        canonical = f"{output_format}\n{canonical_dot(dot_source)}"
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{extension}")
+
+    def get(self, key: str, output_format: str):
+        """Return (output, dot_source) bytes of a cached layout, or None."""
+        if not self.enabled:
+            return None
+        output_path = self._path(key, output_format)
+        try:
+            with open(output_path, 'rb') as file:
+                output = file.read()
+            with open(self._path(key, 'gv'), 'rb') as file:
+                source = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # Refresh the mtime, which is what eviction orders entries by
+            os.utime(output_path)
+        except OSError:
+            pass
+        return output, source
+
+    def put(self, key: str, output_format: str, output: bytes, dot_source: bytes):
+        if not self.enabled:
+            return
+        os.makedirs(os.path.join(self.directory, key[:2]), exist_ok=True)
+        # The source goes first, so a visible output always has its source next to it
+        for extension, data in (('gv', dot_source), (output_format, output)):
+            path = self._path(key, extension)
+            temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_path, 'wb') as file:
+                file.write(data)
+            os.replace(temporary_path, path)
+
+    def record(self, output_format: str, hit_keys: list, miss_keys: list):
+        """Count lookups reported by a render, index the entries it added and evict old ones."""
+        with self._lock:
+            self.hits += len(hit_keys)
+            self.misses += len(miss_keys)
+            if self.enabled:
+                self._load_index()
+                for key in hit_keys:
+                    if key in self._index:
+                        self._index.move_to_end(key)
+                    else:
+                        # Written by another process sharing the directory
+                        self._index_entry(key, output_format)
+                for key in miss_keys:
+                    self._index_entry(key, output_format)
+                if self._bytes > self.max_bytes:
+                    self._trim()
+        metrics.count_layout_cache(len(hit_keys), len(miss_keys))
+
+    def _load_index(self):
+        """Index the entries already on disk, oldest first; called with the lock held."""
+        if self._index is not None:
+            return
+        entries = {}
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.tmp'):
+                    # Being written by a render right now
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                key = entry.name.split('.', 1)[0]
+                mtime, size, paths = entries.get(key, (0, 0, []))
+                entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size, paths + [entry.path])
+        self._index = OrderedDict()
+        for key, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+            self._index[key] = (size, paths)
+            self._bytes += size
+
+    def _index_entry(self, key: str, output_format: str):
+        """Add or replace key's entry as the most recently used; called with the lock held."""
+        size, paths = 0, []
+        for extension in ('gv', output_format):
+            path = self._path(key, extension)
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                continue
+            paths.append(path)
+        previous = self._index.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[0]
+        if paths:
+            self._index[key] = (size, paths)
+            self._bytes += size
+
+    def _trim(self):
+        """Delete least-recently-used entries until the cache fits in max_bytes; called with the lock held."""
+        while self._bytes > self.max_bytes and self._index:
+            _, (size, paths) = self._index.popitem(last=False)
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'layout_cache_hits': self.hits,
+                'layout_cache_misses': self.misses,
+                'layout_cache_hit_rate': self.hits / lookups if lookups else 0.0,
+                'layout_cache_evictions': self.evictions,
+                'layout_cache_bytes': self._bytes,
+            }
+
+layout_cache = LayoutCache(LAYOUT_CACHE_DIR, LAYOUT_CACHE_BYTES)
@@ -0,0 +1,196 @@
+# llm_client.py
+
+import asyncio
+import email.utils
+import random
+import time
+
+import httpx
+import openai
+from backend.config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY,
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX,
+    LLM_EXPECTED_COMPLETION_TOKENS, LLM_STAGE_DEADLINES,
+)
+from backend.app.services.metrics import metrics
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+class LLMError(Exception):
+    """Base class for LLM failures that map to a specific HTTP status."""
+    status_code = 502
+
+class LLMRateLimitedError(LLMError):
+    """The provider kept rate limiting us after every retry."""
+    status_code = 429
+
+class LLMDeadlineExceededError(LLMError):
+    """The stage ran out of time, including waits and retries."""
+    status_code = 504
+
+class TokenBucket:
+    """Asyncio token bucket refilled continuously at rate_per_minute."""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float, deadline: float):
+        # Requests larger than the bucket can still pass once it is full
+        amount = min(amount, self.capacity)
+        # The lock keeps waiters in FIFO order instead of letting small requests starve big ones
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+                if time.monotonic() + wait > deadline:
+                    raise LLMDeadlineExceededError("Deadline exceeded waiting for LLM rate limit budget")
+                await asyncio.sleep(wait)
+
+    def adjust(self, amount: float):
+        """Give back (positive) or take away (negative) tokens once actual usage is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+_async_client = None
+_request_bucket = TokenBucket(LLM_REQUESTS_PER_MINUTE)
+_token_bucket = TokenBucket(LLM_TOKENS_PER_MINUTE)
+
+def get_async_client() -> openai.AsyncOpenAI:
+    """Return the AsyncOpenAI client shared across requests, with a pooled keep-alive HTTP client."""
+    global _async_client
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            # Retries are handled by chat_completion so they share the rate limit budget
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+            ),
+        )
+    return _async_client
+
+async def close_async_client():
+    """Close the shared client and release its HTTP connections."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+def retry_after(error: Exception):
+    """Seconds the provider asked us to wait, from Retry-After(-ms) headers, if any."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+def backoff_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, never shorter than the provider's Retry-After."""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    requested = retry_after(error)
+    return max(delay, requested) if requested is not None else delay
+
+async def _create_with_retries(stage: str, deadline: float, estimated_tokens: int, **kwargs):
+    attempt = 0
+    while True:
+        await _request_bucket.acquire(1, deadline)
+        await _token_bucket.acquire(estimated_tokens, deadline)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceededError(f"LLM {stage} stage exceeded its deadline")
+        try:
+            return await asyncio.wait_for(get_async_client().chat.completions.create(**kwargs), remaining)
+        except asyncio.TimeoutError:
+            raise LLMDeadlineExceededError(f"LLM {stage} stage exceeded its deadline")
+        except RETRYABLE_ERRORS as e:
+            delay = backoff_delay(attempt, e)
+            attempt += 1
+            if attempt > LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                if isinstance(e, openai.RateLimitError):
+                    raise LLMRateLimitedError(f"LLM provider is rate limiting requests: {e}") from e
+                raise
+            print(f"LLM {stage} call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+def _deadline(stage: str) -> float:
+    return time.monotonic() + LLM_STAGE_DEADLINES[stage]
+
+def _estimate_tokens(prompt_tokens: int) -> int:
+    return prompt_tokens + LLM_EXPECTED_COMPLETION_TOKENS
+
+def _record_usage(stage: str, estimated_tokens: int, usage):
+    if usage is None:
+        return
+    _token_bucket.adjust(estimated_tokens - usage.total_tokens)
+    metrics.add_tokens(stage, usage.prompt_tokens, usage.completion_tokens)
+
+async def chat_completion(stage: str, prompt_tokens: int, **kwargs):
+    """chat.completions.create with rate limiting, retries and the stage's deadline."""
+    estimated_tokens = _estimate_tokens(prompt_tokens)
+    with metrics.timed(f"llm_{stage}"):
+        response = await _create_with_retries(stage, _deadline(stage), estimated_tokens, **kwargs)
+    _record_usage(stage, estimated_tokens, getattr(response, 'usage', None))
+    return response
+
+async def stream_chat_completion(stage: str, prompt_tokens: int, **kwargs):
+    """Yield content deltas of a streamed completion, enforcing the stage's deadline throughout."""
+    deadline = _deadline(stage)
+    estimated_tokens = _estimate_tokens(prompt_tokens)
+    with metrics.timed(f"llm_{stage}"):
+        # The final chunk then carries the usage, with no choices
+        stream = await _create_with_retries(
+            stage, deadline, estimated_tokens, stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        iterator = stream.__aiter__()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                await stream.close()
+                raise LLMDeadlineExceededError(f"LLM {stage} stage exceeded its deadline")
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                await stream.close()
+                raise LLMDeadlineExceededError(f"LLM {stage} stage exceeded its deadline")
+            if getattr(chunk, 'usage', None) is not None:
+                _record_usage(stage, estimated_tokens, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -0,0 +1,172 @@
+# metrics.py
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; covers fast file operations up to slow LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Upper bounds in bytes for the peak RSS of a render job, 32 MiB to 4 GiB
+RSS_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(5, 13))
+
+# Stage durations of the current request, collected for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+class _Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Process-wide stage latency histograms and counters, exported in Prometheus text format."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._durations = {}
+        self._outcomes = {}
+        self._tokens = {}
+        self._render_cpu = _Histogram(buckets)
+        self._render_rss = _Histogram(RSS_BUCKETS)
+        self._render_limits = {}
+        self._flights = {}
+        self._layout_cache = {"hit": 0, "miss": 0}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, outcome: str = "success"):
+        with self._lock:
+            histogram = self._durations.get(stage)
+            if histogram is None:
+                histogram = self._durations[stage] = _Histogram(self.buckets)
+            histogram.observe(seconds)
+            self._outcomes[(stage, outcome)] = self._outcomes.get((stage, outcome), 0) + 1
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, seconds))
+
+    def add_tokens(self, stage: str, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            for kind, count in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+                self._tokens[(stage, kind)] = self._tokens.get((stage, kind), 0) + count
+
+    def observe_render_usage(self, cpu_seconds: float, max_rss_bytes: int, limit_exceeded: str = None):
+        """Record the CPU time and peak RSS of one render job, and which budget it blew, if any."""
+        with self._lock:
+            self._render_cpu.observe(cpu_seconds)
+            self._render_rss.observe(max_rss_bytes)
+            if limit_exceeded is not None:
+                self._render_limits[limit_exceeded] = self._render_limits.get(limit_exceeded, 0) + 1
+
+    def count_flight(self, name: str, shared: bool):
+        """Count a single-flight call; shared calls joined one already in progress instead of computing."""
+        with self._lock:
+            key = (name, "shared" if shared else "leader")
+            self._flights[key] = self._flights.get(key, 0) + 1
+
+    def count_layout_cache(self, hits: int, misses: int):
+        with self._lock:
+            self._layout_cache["hit"] += hits
+            self._layout_cache["miss"] += misses
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Time the block and record it as a success, or as an error if it raises."""
+        started_at = time.monotonic()
+        outcome = "success"
+        try:
+            yield
+        except Exception:
+            outcome = "error"
+            raise
+        except BaseException:
+            outcome = "cancelled"
+            raise
+        finally:
+            self.observe(stage, time.monotonic() - started_at, outcome)
+
+    @staticmethod
+    def _histogram_lines(name: str, histogram: _Histogram, **labels) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            if bound == float("inf"):
+                le = "+Inf"
+            else:
+                # Integer bounds (byte sizes) are written out in full rather than rounded by :g
+                le = str(bound) if isinstance(bound, int) else f"{bound:g}"
+            lines.append(f"{name}_bucket{{{_labels(**labels, le=le)}}} {cumulative}")
+        suffix = f"{{{_labels(**labels)}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {histogram.sum}")
+        lines.append(f"{name}_count{suffix} {histogram.count}")
+        return lines
+
+    def render(self) -> str:
+        lines = [
+            "# HELP diagram_stage_duration_seconds Time spent in each pipeline stage.",
+            "# TYPE diagram_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._durations.items()):
+                lines.extend(self._histogram_lines("diagram_stage_duration_seconds", histogram, stage=stage))
+
+            lines.append("# HELP diagram_stage_total Pipeline stages run, by outcome.")
+            lines.append("# TYPE diagram_stage_total counter")
+            for (stage, outcome), count in sorted(self._outcomes.items()):
+                lines.append(f"diagram_stage_total{{{_labels(stage=stage, outcome=outcome)}}} {count}")
+
+            lines.append("# HELP llm_tokens_total Tokens reported by the LLM provider.")
+            lines.append("# TYPE llm_tokens_total counter")
+            for (stage, kind), count in sorted(self._tokens.items()):
+                lines.append(f"llm_tokens_total{{{_labels(stage=stage, kind=kind)}}} {count}")
+
+            lines.append("# HELP render_cpu_seconds CPU time used by each render job, including Graphviz.")
+            lines.append("# TYPE render_cpu_seconds histogram")
+            lines.extend(self._histogram_lines("render_cpu_seconds", self._render_cpu))
+            lines.append("# HELP render_max_rss_bytes Peak resident set size of each render job.")
+            lines.append("# TYPE render_max_rss_bytes histogram")
+            lines.extend(self._histogram_lines("render_max_rss_bytes", self._render_rss))
+            lines.append("# HELP render_limit_exceeded_total Render jobs killed or failed for exceeding a budget.")
+            lines.append("# TYPE render_limit_exceeded_total counter")
+            for limit, count in sorted(self._render_limits.items()):
+                lines.append(f"render_limit_exceeded_total{{{_labels(limit=limit)}}} {count}")
+
+            lines.append("# HELP single_flight_calls_total Coalesced calls; role=\"shared\" ones were saved.")
+            lines.append("# TYPE single_flight_calls_total counter")
+            for (name, role), count in sorted(self._flights.items()):
+                lines.append(f"single_flight_calls_total{{{_labels(name=name, role=role)}}} {count}")
+
+            lines.append("# HELP layout_cache_lookups_total Graphviz layout cache lookups, by result.")
+            lines.append("# TYPE layout_cache_lookups_total counter")
+            for result, count in self._layout_cache.items():
+                lines.append(f"layout_cache_lookups_total{{{_labels(result=result)}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def start_request():
+        """Start collecting stage timings for the current request; returns the list they go into."""
+        timings = []
+        _request_timings.set(timings)
+        return timings
+
+    @staticmethod
+    def server_timing(timings: list) -> str:
+        """Format collected timings as a Server-Timing header, summing repeated stages."""
+        totals = {}
+        for stage, seconds in timings:
+            totals[stage] = totals.get(stage, 0) + seconds
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+metrics = Metrics()
@@ -0,0 +1,186 @@
+# prompt_compiler.py
+
+import json
+import re
+import threading
+from collections import Counter
+
+from backend.config import (
+    llm1, llm2, llm2_spec, aws_categories, azure_categories, gcp_categories, CLOUD_PROVIDERS,
+    LLM_MODEL, LLM2_PROMPT_TOKEN_BUDGET,
+)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+PROVIDER_CATEGORIES = {"aws": aws_categories, "azure": azure_categories, "gcp": gcp_categories}
+
+# llm2 template for each diagram output mode
+DIAGRAM_TEMPLATES = {"code": llm2, "spec": llm2_spec}
+
+IMPORT_PATTERN = re.compile(r"^\s*from\s+diagrams\.(\w+)\.\w+\s+import\s+(.+)$", re.MULTILINE)
+
+# Roughly how tiktoken splits English and code when the encoding isn't available
+_APPROXIMATE_TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]|\s+")
+
+# Placeholder that survives str.format so templates can be split around the dynamic fields
+_SLOT = "\x00slot\x00"
+
+def _load_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(LLM_MODEL)
+    except Exception:
+        # Unknown model or the encoding file can't be downloaded; fall back to the estimate
+        return None
+
+class CompiledPrompt:
+    def __init__(self, text: str, tokens: int, dropped_icons: int = 0):
+        self.text = text
+        self.tokens = tokens
+        self.dropped_icons = dropped_icons
+
+class PromptCompiler:
+    """Builds llm1/llm2 prompts from templates pre-rendered once per provider.
+
+    The llm2 icon list is fitted to a token budget: every category keeps its
+    best-ranked icon, then icons are added round-robin in rank order until the
+    budget is used up, and the last ones added are dropped again if the full
+    prompt still comes out over it. Icons rank by how often generated code
+    imported them, then by how generic they are (prefix of other icon names,
+    shorter name).
+    """
+
+    def __init__(self, token_budget: int):
+        self.token_budget = token_budget
+        self._encoding = _load_encoding()
+        self._usage = Counter()
+        self._lock = threading.Lock()
+        self._architecture_parts = {}
+        self._diagram_parts = {}
+        for provider in CLOUD_PROVIDERS:
+            self._architecture_parts[provider] = self._split(llm1.format(
+                cloud_provider=provider,
+                categories=PROVIDER_CATEGORIES[provider],
+                project_description=_SLOT,
+            ))
+            for mode, template in DIAGRAM_TEMPLATES.items():
+                self._diagram_parts[(mode, provider)] = self._split(template.format(
+                    cloud_provider=provider,
+                    icon_list=_SLOT,
+                    project_description=_SLOT,
+                ))
+        self.prompts_compiled = 0
+        self.prompt_tokens = 0
+        self.icons_dropped = 0
+
+    def _split(self, rendered: str) -> tuple:
+        parts = rendered.split(_SLOT)
+        return tuple(parts), sum(self.count_tokens(part) for part in parts)
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(_APPROXIMATE_TOKEN_PATTERN.findall(text))
+
+    def record_usage(self, cloud_provider: str, diagram_code: str):
+        """Count the icons generated code imports so popular icons survive trimming."""
+        self.record_icons(cloud_provider, [
+            name.split(' as ')[0].strip(' ()')
+            for provider, names in IMPORT_PATTERN.findall(diagram_code) if provider == cloud_provider
+            for name in names.split(',')
+        ])
+
+    def record_icons(self, cloud_provider: str, icons: list):
+        with self._lock:
+            for icon in icons:
+                self._usage[(cloud_provider, icon)] += 1
+
+    def rank_icons(self, cloud_provider: str, icons: list) -> list:
+        with self._lock:
+            usage = {icon: self._usage[(cloud_provider, icon)] for icon in icons}
+        generic = {icon: sum(other != icon and other.startswith(icon) for other in icons) for icon in icons}
+        return sorted(icons, key=lambda icon: (-usage[icon], -generic[icon], len(icon), icon))
+
+    def _icon_cost(self, icon: str) -> int:
+        """Tokens one more icon adds to the serialized list, including its quotes and comma."""
+        return self.count_tokens(f",{json.dumps(icon)}")
+
+    def fit_icons(self, cloud_provider: str, icons_by_category: dict, token_budget: int) -> tuple:
+        """Trim icons_by_category to fit token_budget; returns (icons, dropped_count)."""
+        ranked = {
+            category: self.rank_icons(cloud_provider, icons)
+            for category, icons in icons_by_category.items()
+        }
+        selected = {category: icons[:1] for category, icons in ranked.items()}
+        used = self.count_tokens(json.dumps(selected, separators=(',', ':')))
+        depth = 1
+        while used < token_budget and any(len(icons) > depth for icons in ranked.values()):
+            for category, icons in ranked.items():
+                if len(icons) <= depth:
+                    continue
+                cost = self._icon_cost(icons[depth])
+                if used + cost > token_budget:
+                    continue
+                selected[category].append(icons[depth])
+                used += cost
+            depth += 1
+        dropped = sum(len(icons) for icons in ranked.values()) - sum(len(icons) for icons in selected.values())
+        return selected, dropped
+
+    def _record(self, prompt: CompiledPrompt) -> CompiledPrompt:
+        with self._lock:
+            self.prompts_compiled += 1
+            self.prompt_tokens += prompt.tokens
+            self.icons_dropped += prompt.dropped_icons
+        return prompt
+
+    @staticmethod
+    def _check_provider(cloud_provider: str):
+        if cloud_provider not in CLOUD_PROVIDERS:
+            raise ValueError(f"Unsupported cloud provider: {cloud_provider}")
+
+    def architecture_prompt(self, cloud_provider: str, project_description: str) -> CompiledPrompt:
+        self._check_provider(cloud_provider)
+        (before, after), _ = self._architecture_parts[cloud_provider]
+        text = f"{before}{project_description}{after}"
+        return self._record(CompiledPrompt(text, self.count_tokens(text)))
+
+    def diagram_prompt(
+        self, cloud_provider: str, icons_by_category: dict, project_description: str, mode: str = "code"
+    ) -> CompiledPrompt:
+        self._check_provider(cloud_provider)
+        (head, middle, tail), static_tokens = self._diagram_parts[(mode, cloud_provider)]
+        description_tokens = self.count_tokens(project_description)
+        icon_budget = max(self.token_budget - static_tokens - description_tokens, 0)
+        icons, dropped = self.fit_icons(cloud_provider, icons_by_category, icon_budget)
+        # Tokens can merge across the seams between parts, so the estimate is checked against the real prompt
+        while True:
+            icon_list = json.dumps(icons, separators=(',', ':'))
+            text = f"{head}{icon_list}{middle}{project_description}{tail}"
+            tokens = self.count_tokens(text)
+            excess = tokens - self.token_budget
+            if excess <= 0 or all(len(category_icons) <= 1 for category_icons in icons.values()):
+                break
+            # Drop the icons fit_icons added last until their estimated cost covers the excess
+            while excess > 0 and any(len(category_icons) > 1 for category_icons in icons.values()):
+                deepest = max(len(category_icons) for category_icons in icons.values())
+                category = [name for name, category_icons in icons.items() if len(category_icons) == deepest][-1]
+                excess -= self._icon_cost(icons[category].pop())
+                dropped += 1
+        return self._record(CompiledPrompt(text, tokens, dropped))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'prompts_compiled': self.prompts_compiled,
+                'prompt_tokens': self.prompt_tokens,
+                'icons_dropped': self.icons_dropped,
+                'token_budget': self.token_budget,
+                'exact_token_counts': self._encoding is not None,
+            }
+
+prompt_compiler = PromptCompiler(LLM2_PROMPT_TOKEN_BUDGET)
@@ -0,0 +1,226 @@
+# render_cache.py
+
+import functools
+import hashlib
+import importlib.metadata
+import io
+import os
+import shutil
+import subprocess
+import threading
+import tokenize
+from collections import OrderedDict
+
+from backend.config import (
+    RENDER_CACHE_DIR, RENDER_CACHE_MEMORY_ENTRIES, RENDER_CACHE_DISK_BYTES, RENDER_OUTPUT_FORMAT, GRAPHVIZ_DOT,
+)
+from backend.app.services.artifact_store import artifact_store
+from backend.app.services.derivative_store import derivative_store
+from backend.app.utils.helpers import extract_python_code
+
+# DOT sources are kept next to the images as <index>.gv
+SOURCE_EXTENSION = '.gv'
+
+_IGNORED_TOKENS = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+
+def normalize_code(diagram_code: str) -> str:
+    """Reduce diagram code to its tokens so whitespace and comments don't change the key."""
+    code = extract_python_code(diagram_code)
+    try:
+        tokens = [
+            token.string if token.type not in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT)
+            else tokenize.tok_name[token.type]
+            for token in tokenize.generate_tokens(io.StringIO(code).readline)
+            if token.type not in _IGNORED_TOKENS
+        ]
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Not valid Python; fall back to a line-based normalization
+        lines = [line.split('#', 1)[0].strip() for line in code.splitlines()]
+        return '\n'.join(line for line in lines if line)
+    return ' '.join(tokens)
+
+@functools.lru_cache(maxsize=1)
+def renderer_version() -> str:
+    """The diagrams and Graphviz versions renders come from, so upgrading either invalidates the cache."""
+    try:
+        diagrams_version = importlib.metadata.version('diagrams')
+    except importlib.metadata.PackageNotFoundError:
+        diagrams_version = "unknown"
+    try:
+        # dot -V prints e.g. "dot - graphviz version 2.43.0 (0)" to stderr
+        result = subprocess.run(
+            [GRAPHVIZ_DOT, '-V'], stdin=subprocess.DEVNULL, capture_output=True, timeout=10,
+        )
+        graphviz_version = result.stderr.decode('utf-8', errors='replace').strip() or "unknown"
+    except (OSError, subprocess.TimeoutExpired):
+        graphviz_version = "unknown"
+    return f"diagrams {diagrams_version}; {graphviz_version}"
+
+def code_hash(diagram_code: str) -> str:
+    """Cache key of one diagram: its normalized code plus the output format and renderer versions."""
+    key = f"{RENDER_OUTPUT_FORMAT}\n{renderer_version()}\n{normalize_code(diagram_code)}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class RenderCache:
+    """Two-tier cache mapping the normalized code of one diagram to its rendered artifact keys.
+
+    The memory tier holds artifact keys in LRU order. The disk tier keeps a copy
+    of the images, and of the DOT sources of SVGs, under <directory>/<hash>/ so
+    entries survive artifact cleanup and restarts, and is evicted
+    least-recently-used once it exceeds max_bytes. Every hit restarts the expiry
+    of the DOT sources, so cached SVGs keep their raster variants.
+    """
+
+    def __init__(self, directory: str, memory_entries: int, max_bytes: int):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_disk_index()
+
+    def _load_disk_index(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            if entry.name.endswith('.tmp'):
+                # Left behind by an interrupted put()
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            files = list(os.scandir(entry.path))
+            size = sum(file.stat().st_size for file in files)
+            entries.append((entry.stat().st_mtime, entry.name, size))
+        for _, digest, size in sorted(entries):
+            self._disk[digest] = size
+            self._disk_bytes += size
+
+    def _remember(self, digest: str, keys: list):
+        self._memory[digest] = keys
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, diagram_code: str):
+        """Return the artifact keys for previously rendered code, or None."""
+        digest = code_hash(diagram_code)
+        with self._lock:
+            keys = self._memory.get(digest)
+            keys = list(keys) if keys is not None else None
+        # With the S3 backend each check is a HEAD request, so they run outside the lock
+        if keys is not None and all(artifact_store.exists(key) for key in keys):
+            with self._lock:
+                if digest in self._memory:
+                    self._memory.move_to_end(digest)
+                self.memory_hits += 1
+            self._refresh_sources(digest, keys)
+            return keys
+
+        with self._lock:
+            in_disk_tier = digest in self._disk
+            if in_disk_tier:
+                self._disk.move_to_end(digest)
+
+        if in_disk_tier:
+            entry_dir = os.path.join(self.directory, digest)
+            try:
+                names = sorted(name for name in os.listdir(entry_dir) if not name.endswith(SOURCE_EXTENSION))
+                keys = [
+                    artifact_store.put_file(os.path.join(entry_dir, name), keep_source=True)
+                    for name in names
+                ]
+                os.utime(entry_dir)
+            except OSError:
+                keys = None
+            if keys:
+                with self._lock:
+                    self._remember(digest, keys)
+                    self.disk_hits += 1
+                self._refresh_sources(digest, keys)
+                return list(keys)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _refresh_sources(self, digest: str, keys: list):
+        """Restart the expiry of the DOT sources of SVG keys, restoring expired ones from the disk tier."""
+        for index, key in enumerate(keys):
+            if not key.endswith('.svg'):
+                continue
+            artifact_digest = artifact_store.digest(key)
+            if derivative_store.refresh_source(artifact_digest):
+                continue
+            try:
+                with open(os.path.join(self.directory, digest, f"{index:03d}{SOURCE_EXTENSION}"), 'rb') as file:
+                    derivative_store.put_source(artifact_digest, file.read())
+            except OSError:
+                pass
+
+    def put(self, diagram_code: str, keys: list):
+        """Record the artifact keys rendered for diagram_code in both tiers."""
+        if not keys:
+            return
+        digest = code_hash(diagram_code)
+        with self._lock:
+            self._remember(digest, list(keys))
+            if digest in self._disk:
+                return
+
+        entry_dir = os.path.join(self.directory, digest)
+        temporary_dir = f"{entry_dir}.{threading.get_ident()}.tmp"
+        size = 0
+        try:
+            os.makedirs(temporary_dir, exist_ok=True)
+            for index, key in enumerate(keys):
+                data = artifact_store.get(key)
+                if data is None:
+                    raise FileNotFoundError(key)
+                # Prefix with the position so a disk hit returns images in their original order
+                destination = os.path.join(temporary_dir, f"{index:03d}{os.path.splitext(key)[1]}")
+                with open(destination, 'wb') as file:
+                    file.write(data)
+                size += len(data)
+                source = derivative_store.get_source(artifact_store.digest(key)) if key.endswith('.svg') else None
+                if source is not None:
+                    with open(os.path.join(temporary_dir, f"{index:03d}{SOURCE_EXTENSION}"), 'wb') as file:
+                        file.write(source)
+                    size += len(source)
+            os.replace(temporary_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk[digest] = size
+            self._disk_bytes += size
+            while self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                old_digest, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_digest)
+        for old_digest in evicted:
+            shutil.rmtree(os.path.join(self.directory, old_digest), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+            }
+
+render_cache = RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MEMORY_ENTRIES, RENDER_CACHE_DISK_BYTES)
@@ -0,0 +1,426 @@
+# renderer_pool.py
+
+import importlib
+import multiprocessing
+import os
+import queue
+import resource
+import select
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+
+from backend.config import RENDER_MAX_WORKERS
+from backend.app.services.layout_cache import layout_cache
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.svg')
+
+# DOT source written next to each image so raster variants can be derived later
+SOURCE_EXTENSION = '.gv'
+
+# Written by render children to the job's work dir, one "hit <key>" or "miss <key>" line per diagram
+LAYOUT_CACHE_LOG = '.layout_cache'
+
+# Captured stdout/stderr of a job is truncated to this many bytes
+MAX_OUTPUT_BYTES = 64 * 1024
+
+# Renders of every kind running at once in this process (pool jobs, graph spec diagrams and
+# raster derivatives) share these slots, so together they never exceed RENDER_MAX_WORKERS
+render_slots = threading.BoundedSemaphore(RENDER_MAX_WORKERS)
+
+# Signals the kernel sends when an rlimit is hit; Graphviz children die of them, Python ignores SIGXFSZ
+LIMIT_SIGNALS = {signal.SIGXCPU: 'cpu', signal.SIGXFSZ: 'output'}
+
+# Builtins generated code may use; the validator already rejects the rest, this is a second layer
+SAFE_BUILTINS = (
+    'abs', 'all', 'any', 'bool', 'dict', 'enumerate', 'filter', 'float', 'format', 'frozenset', 'int',
+    'isinstance', 'len', 'list', 'map', 'max', 'min', 'print', 'range', 'repr', 'reversed', 'round',
+    'set', 'sorted', 'str', 'sum', 'tuple', 'zip', 'Exception', 'ValueError', '__build_class__',
+)
+
+def _diagrams_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or (name != 'diagrams' and not name.startswith('diagrams.')):
+        raise ImportError(f"import of '{name}' is not allowed")
+    return __import__(name, globals, locals, fromlist, level)
+
+def restricted_globals() -> dict:
+    """Globals generated code is executed with: a few builtins and imports of diagrams only."""
+    import builtins
+    safe_builtins = {name: getattr(builtins, name) for name in SAFE_BUILTINS}
+    safe_builtins['__import__'] = _diagrams_import
+    return {'__name__': '__main__', '__builtins__': safe_builtins}
+
+def _preload(modules: list):
+    for module in ['diagrams', 'diagrams.onprem.client', 'diagrams.onprem.compute'] + modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+def _force_output_format(output_format: str):
+    """Make every Diagram render only output_format, never open a viewer, and keep its DOT source.
+
+    Graphs already laid out are copied from the layout cache instead of
+    running Graphviz; each lookup's outcome and key are appended to LAYOUT_CACHE_LOG.
+    """
+    import diagrams
+
+    def render(self):
+        source = self.dot.source
+        output_path = f"{self.filename}.{output_format}"
+        key = layout_cache.key_for(source, output_format)
+        cached = layout_cache.get(key, output_format)
+        if cached is not None:
+            output, source_bytes = cached
+            # Diagram.__exit__ removes the DOT file Graphviz rendering would have saved
+            self.dot.save()
+            with open(output_path, 'wb') as file:
+                file.write(output)
+        else:
+            source_bytes = source.encode('utf-8')
+            self.dot.render(format=output_format, view=False, quiet=True)
+            with open(output_path, 'rb') as file:
+                layout_cache.put(key, output_format, file.read(), source_bytes)
+        # The source the output was laid out from, which raster variants are derived from
+        with open(f"{self.filename}{SOURCE_EXTENSION}", 'wb') as file:
+            file.write(source_bytes)
+        with open(LAYOUT_CACHE_LOG, 'a') as file:
+            file.write(f"{'hit' if cached is not None else 'miss'} {key}\n")
+
+    diagrams.Diagram.render = render
+
+def _apply_limits(limits: dict):
+    """Set the job's rlimits; processes the child starts (Graphviz) inherit them."""
+    if limits.get('cpu_seconds'):
+        # The soft limit sends SIGXCPU, the hard one a second later SIGKILL
+        resource.setrlimit(resource.RLIMIT_CPU, (limits['cpu_seconds'], limits['cpu_seconds'] + 1))
+    if limits.get('memory_bytes'):
+        resource.setrlimit(resource.RLIMIT_AS, (limits['memory_bytes'], limits['memory_bytes']))
+    if limits.get('output_bytes'):
+        resource.setrlimit(resource.RLIMIT_FSIZE, (limits['output_bytes'], limits['output_bytes']))
+
+def _exceeded_limit(exit_code: int, cpu_seconds: float, output: str, limits: dict):
+    """Name the budget a finished job ran out of ('cpu', 'memory' or 'output'), or None."""
+    if exit_code < 0 and -exit_code in LIMIT_SIGNALS:
+        return LIMIT_SIGNALS[-exit_code]
+    if exit_code == -signal.SIGKILL and limits.get('cpu_seconds') and cpu_seconds >= limits['cpu_seconds']:
+        return 'cpu'
+    if exit_code == 0:
+        return None
+    # A Graphviz child hit the limit and the Python code reported its failure
+    for signal_number, limit in LIMIT_SIGNALS.items():
+        if signal_number.name in output:
+            return limit
+    if 'File too large' in output:
+        return 'output'
+    if 'MemoryError' in output or 'out of memory' in output.lower() or 'Cannot allocate memory' in output:
+        return 'memory'
+    return None
+
+def limit_error(limit: str, limits: dict) -> str:
+    """How an exceeded budget is reported back to the user."""
+    if limit == 'cpu':
+        return f"Rendering exceeded its CPU budget of {limits['cpu_seconds']} seconds"
+    if limit == 'memory':
+        return f"Rendering exceeded its memory budget of {limits['memory_bytes'] // (1024 * 1024)} MiB"
+    return f"Rendering exceeded its output budget of {limits['output_bytes'] // (1024 * 1024)} MiB per file"
+
+def run_limited(args: list, input_data: bytes, timeout: float, limits: dict) -> dict:
+    """Run a command outside the pool under the same rlimits and timeout as a render job.
+
+    stdout is returned as bytes and counts against the output budget, since
+    RLIMIT_FSIZE doesn't cover pipes. Raises FileNotFoundError if the
+    executable is missing.
+    """
+    with tempfile.TemporaryFile() as stdin:
+        stdin.write(input_data)
+        stdin.seek(0)
+        process = subprocess.Popen(
+            args,
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=lambda: _apply_limits(limits),
+            start_new_session=True,
+        )
+
+    received = {process.stdout: [], process.stderr: []}
+    sizes = {process.stdout: 0, process.stderr: 0}
+    timed_out = output_exceeded = False
+    deadline = time.monotonic() + timeout
+    open_streams = [process.stdout, process.stderr]
+    while open_streams:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        ready, _, _ = select.select(open_streams, [], [], remaining)
+        for stream in ready:
+            chunk = os.read(stream.fileno(), 65536)
+            if not chunk:
+                open_streams.remove(stream)
+                continue
+            sizes[stream] += len(chunk)
+            if stream is process.stdout or sizes[stream] <= MAX_OUTPUT_BYTES:
+                received[stream].append(chunk)
+        if limits.get('output_bytes') and sizes[process.stdout] > limits['output_bytes']:
+            output_exceeded = True
+            break
+
+    if timed_out or output_exceeded:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+    # Reap it here rather than through Popen so the rusage comes with it
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    process.stdout.close()
+    process.stderr.close()
+    cpu_seconds = usage.ru_utime + usage.ru_stime
+    output = b''.join(received[process.stderr])[:MAX_OUTPUT_BYTES].decode('utf-8', errors='replace')
+
+    if output_exceeded:
+        limit_exceeded = 'output'
+    elif timed_out:
+        limit_exceeded = None
+    else:
+        limit_exceeded = _exceeded_limit(process.returncode, cpu_seconds, output, limits)
+    return {
+        'stdout': b''.join(received[process.stdout]),
+        'exit_code': process.returncode,
+        'timed_out': timed_out,
+        'limit_exceeded': limit_exceeded,
+        'output': output,
+        'usage': {'cpu_seconds': cpu_seconds, 'max_rss_bytes': usage.ru_maxrss * 1024},
+    }
+
+def _run_child(code: str, work_dir: str, write_fd: int, output_format: str, limits: dict):
+    """Body of the forked per-job child; never returns."""
+    exit_code = 0
+    try:
+        os.setpgid(0, 0)
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.chdir(work_dir)
+        _apply_limits(limits)
+        _force_output_format(output_format)
+        exec(compile(code, 'generated_diagram.py', 'exec'), restricted_globals())
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        try:
+            import sys
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+def _run_job(code: str, work_dir: str, timeout: float, output_format: str, limits: dict) -> dict:
+    """Fork a child of this warm worker, run the code in it under limits and collect the images it wrote."""
+    started_at = time.monotonic()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        _run_child(code, work_dir, write_fd, output_format, limits)
+    os.close(write_fd)
+
+    output = b''
+    timed_out = False
+    deadline = time.monotonic() + timeout
+    with os.fdopen(read_fd, 'rb', buffering=0) as reader:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            ready, _, _ = select.select([reader], [], [], remaining)
+            if not ready:
+                continue
+            chunk = reader.read(4096)
+            if not chunk:
+                break
+            if len(output) < MAX_OUTPUT_BYTES:
+                output += chunk[:MAX_OUTPUT_BYTES - len(output)]
+
+    if timed_out:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            os.kill(pid, signal.SIGKILL)
+    # Usage of the child includes the Graphviz processes it waited for
+    _, status, usage = os.wait4(pid, 0)
+    exit_code = os.waitstatus_to_exitcode(status)
+    executed_at = time.monotonic()
+    cpu_seconds = usage.ru_utime + usage.ru_stime
+    output = output.decode('utf-8', errors='replace')
+
+    layout_cache_lookups = {'hit': [], 'miss': []}
+    try:
+        with open(os.path.join(work_dir, LAYOUT_CACHE_LOG)) as file:
+            for line in file:
+                outcome, _, key = line.strip().partition(' ')
+                if outcome in layout_cache_lookups and key:
+                    layout_cache_lookups[outcome].append(key)
+    except FileNotFoundError:
+        pass
+
+    # Images go back to the caller as bytes so they never need to be re-read from disk
+    images = []
+    sources = []
+    for entry in sorted(os.scandir(work_dir), key=lambda entry: entry.name):
+        extension = os.path.splitext(entry.name)[1].lower()
+        if not entry.is_file() or extension not in IMAGE_EXTENSIONS + (SOURCE_EXTENSION,):
+            continue
+        with open(entry.path, 'rb') as file:
+            (sources if extension == SOURCE_EXTENSION else images).append({'name': entry.name, 'data': file.read()})
+
+    return {
+        'images': images,
+        'sources': sources,
+        'exit_code': exit_code,
+        'timed_out': timed_out,
+        'limit_exceeded': None if timed_out else _exceeded_limit(exit_code, cpu_seconds, output, limits),
+        'output': output,
+        'timings': {'execute': executed_at - started_at, 'image_collect': time.monotonic() - executed_at},
+        # ru_maxrss is in kilobytes on Linux
+        'usage': {'cpu_seconds': cpu_seconds, 'max_rss_bytes': usage.ru_maxrss * 1024},
+        'layout_cache': layout_cache_lookups,
+    }
+
+def _worker_main(conn, modules: list):
+    """Entry point of a pooled renderer process."""
+    _preload(modules)
+    conn.send({'ready': True})
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        try:
+            result = _run_job(job['code'], job['work_dir'], job['timeout'], job['output_format'], job['limits'])
+        except Exception:
+            result = {
+                'images': [],
+                'sources': [],
+                'exit_code': 1,
+                'timed_out': False,
+                'limit_exceeded': None,
+                'output': traceback.format_exc(),
+                'timings': {},
+                'usage': None,
+                'layout_cache': {'hit': [], 'miss': []},
+            }
+        conn.send(result)
+    conn.close()
+
+class RenderError(Exception):
+    """Raised when the pool cannot run a render job."""
+
+class _Worker:
+    def __init__(self, context, modules: list):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, modules), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def wait_ready(self, timeout: float) -> bool:
+        return self.conn.poll(timeout) and self.conn.recv().get('ready', False)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class RendererPool:
+    """Pool of warm renderer processes that fork a fresh child per job.
+
+    limits caps each job's 'cpu_seconds', 'memory_bytes' and 'output_bytes'
+    with rlimits; a job that exceeds one is killed or fails, and its result
+    names the budget under 'limit_exceeded'.
+    """
+
+    def __init__(self, size: int, timeout: float, modules: list, output_format: str = "png",
+                 limits: dict = None, startup_timeout: float = 60):
+        self.size = size
+        self.timeout = timeout
+        self.output_format = output_format
+        self.limits = limits or {}
+        self.modules = modules
+        self.startup_timeout = startup_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            workers = [_Worker(self._context, self.modules) for _ in range(self.size)]
+            for worker in workers:
+                if not worker.wait_ready(self.startup_timeout):
+                    worker.stop()
+                    worker = _Worker(self._context, self.modules)
+                    worker.wait_ready(self.startup_timeout)
+                self._workers.append(worker)
+                self._idle.put(worker)
+            self._started = True
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+            self._workers = []
+            self._idle = queue.Queue()
+            self._started = False
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.stop()
+        replacement = _Worker(self._context, self.modules)
+        replacement.wait_ready(self.startup_timeout)
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self._workers.append(replacement)
+        return replacement
+
+    def render(self, code: str, work_dir: str) -> dict:
+        """Run code in work_dir on an idle worker and return its result dict."""
+        self.start()
+        worker = self._idle.get()
+        try:
+            worker.conn.send({
+                'code': code,
+                'work_dir': work_dir,
+                'timeout': self.timeout,
+                'output_format': self.output_format,
+                'limits': self.limits,
+            })
+            # The worker enforces the job timeout itself; this only guards against a hung worker
+            if not worker.conn.poll(self.timeout + 10):
+                raise RenderError("Renderer worker did not respond")
+            return worker.conn.recv()
+        except (RenderError, EOFError, BrokenPipeError, OSError) as e:
+            worker = self._replace(worker)
+            raise RenderError(str(e) or "Renderer worker crashed") from e
+        finally:
+            self._idle.put(worker)
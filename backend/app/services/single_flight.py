@@ -0,0 +1,104 @@
+# single_flight.py
+
+import asyncio
+
+from backend.app.services.metrics import metrics
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one in-progress computation.
+
+    The first caller for a key starts the computation as a task; callers that
+    arrive while it runs await the same task and get its result or exception.
+    The task is only cancelled once every caller waiting on it is cancelled,
+    so one client going away doesn't fail the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+
+    async def run(self, key: str, compute):
+        """Return the result of compute() for key, sharing a computation already in flight.
+
+        compute is a zero-argument coroutine function; it runs in the
+        context of the caller that started the flight.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = {'task': asyncio.ensure_future(compute()), 'waiters': 0}
+            self._flights[key] = flight
+            flight['task'].add_done_callback(lambda _: self._forget(key, flight))
+            metrics.count_flight(self.name, shared=False)
+        else:
+            metrics.count_flight(self.name, shared=True)
+
+        flight['waiters'] += 1
+        try:
+            return await asyncio.shield(flight['task'])
+        except asyncio.CancelledError:
+            if flight['waiters'] == 1 and not flight['task'].done():
+                flight['task'].cancel()
+            raise
+        finally:
+            flight['waiters'] -= 1
+
+    async def stream(self, key: str, produce):
+        """Yield the items of produce() for key, sharing a stream already in flight.
+
+        produce is a zero-argument async generator function, pumped by a task.
+        Callers that join a running stream first get the items it has already
+        yielded, then the rest as they arrive. The task is cancelled once
+        every caller consuming it has gone away.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = {'items': [], 'changed': asyncio.get_running_loop().create_future(), 'waiters': 0}
+            flight['task'] = asyncio.ensure_future(self._pump(produce, flight))
+            self._flights[key] = flight
+            flight['task'].add_done_callback(lambda _: self._forget(key, flight))
+            metrics.count_flight(self.name, shared=False)
+        else:
+            metrics.count_flight(self.name, shared=True)
+
+        flight['waiters'] += 1
+        try:
+            index = 0
+            while True:
+                if index < len(flight['items']):
+                    yield flight['items'][index]
+                    index += 1
+                elif flight['task'].done():
+                    # Raises the producer's exception, if it failed
+                    flight['task'].result()
+                    return
+                else:
+                    await asyncio.wait([flight['changed'], flight['task']], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            flight['waiters'] -= 1
+            if flight['waiters'] == 0 and not flight['task'].done():
+                # Callers arriving from now on start a fresh stream
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight['task'].cancel()
+
+    @staticmethod
+    async def _pump(produce, flight: dict):
+        async for item in produce():
+            flight['items'].append(item)
+            changed, flight['changed'] = flight['changed'], asyncio.get_running_loop().create_future()
+            changed.set_result(None)
+
+    def _forget(self, key: str, flight: dict):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Retrieve the exception so an unawaited failure isn't logged as "never retrieved"
+        if not flight['task'].cancelled():
+            flight['task'].exception()
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+architecture_flights = SingleFlight("architecture")
+architecture_stream_flights = SingleFlight("architecture_stream")
+diagram_flights = SingleFlight("diagram")
+render_flights = SingleFlight("render")
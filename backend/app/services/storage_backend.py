@@ -0,0 +1,278 @@
+# storage_backend.py
+
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from backend.config import (
+    ARTIFACT_BACKEND, ARTIFACT_DIR, ARTIFACT_TTL, DERIVATIVE_DIR, DERIVATIVE_TTL,
+    S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION, S3_PRESIGN_TTL, S3_REFRESH_INTERVAL,
+)
+from backend.app.services.expiry_manager import expiry_manager
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+    ClientError = None
+
+CHUNK_SIZE = 64 * 1024
+
+# Keys whose last refresh an S3 backend remembers, so repeated hits skip the round trips
+S3_REFRESHED_KEYS = 100000
+
+# Keys are content hashes, so stored objects never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+class StorageBackend:
+    """Durable home of artifacts, shared by every worker and node configured with the same backend.
+
+    Keys are '/'-separated relative paths. ttl is a hint; backends without
+    their own expiry (S3 relies on bucket lifecycle rules) ignore it.
+    """
+
+    def put(self, key: str, data: bytes, content_type: str = None, ttl: float = None):
+        raise NotImplementedError
+
+    def put_stream(self, key: str, stream, content_type: str = None, ttl: float = None):
+        """Store the contents of a readable binary file object without loading it all at once."""
+        raise NotImplementedError
+
+    def get(self, key: str):
+        """Return the object's bytes, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE):
+        """Return an iterator over the object's bytes, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def refresh(self, key: str, ttl: float = None) -> bool:
+        """Restart the object's expiry if it exists; returns whether it does."""
+        return self.exists(key)
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def url(self, key: str):
+        """A URL clients can fetch the object from directly, or None to serve it through the API."""
+        return None
+
+    def track_existing(self):
+        """Pick up objects left by a previous run so they still expire."""
+
+    def stats(self) -> dict:
+        return {'backend': type(self).__name__}
+
+class LocalStorageBackend(StorageBackend):
+    """Files under root, expired by the expiry manager; shared across workers on one host or a shared volume."""
+
+    def __init__(self, root: str, default_ttl: float):
+        self.root = root
+        self.default_ttl = default_ttl
+        os.makedirs(self.root, exist_ok=True)
+
+    def track_existing(self):
+        expiry_manager.track_existing(self.root, ttl=self.default_ttl)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def _write(self, key: str, write, ttl: float):
+        destination = self.path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        temporary_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            write(file)
+        os.replace(temporary_path, destination)
+        expiry_manager.track(destination, ttl=self.default_ttl if ttl is None else ttl)
+
+    def put(self, key: str, data: bytes, content_type: str = None, ttl: float = None):
+        self._write(key, lambda file: file.write(data), ttl)
+
+    def put_stream(self, key: str, stream, content_type: str = None, ttl: float = None):
+        self._write(key, lambda file: shutil.copyfileobj(stream, file, CHUNK_SIZE), ttl)
+
+    def get(self, key: str):
+        try:
+            with open(self.path(key), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE):
+        try:
+            file = open(self.path(key), 'rb')
+        except FileNotFoundError:
+            return None
+
+        def chunks():
+            with file:
+                while True:
+                    chunk = file.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+        return chunks()
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def refresh(self, key: str, ttl: float = None) -> bool:
+        path = self.path(key)
+        try:
+            # Other processes sharing root only learn about the refresh from the mtime
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        expiry_manager.track(path, ttl=self.default_ttl if ttl is None else ttl)
+        # The reaper may have picked the file between the check and the track
+        return os.path.isfile(path)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+class S3StorageBackend(StorageBackend):
+    """Objects in an S3-compatible bucket (AWS S3, MinIO, ...), served through presigned URLs.
+
+    Expiry is left to the bucket's lifecycle rules, which count from LastModified.
+    refresh() resets it with an in-place copy at most once per refresh_interval;
+    within that window it answers from memory without any request.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None, region: str = None,
+                 presign_ttl: float = 3600, refresh_interval: float = 24 * 60 * 60, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("ARTIFACT_BACKEND=s3 requires boto3 (pip install boto3)")
+            client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.presign_ttl = presign_ttl
+        self.refresh_interval = refresh_interval
+        self._refreshed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _extra_args(self, content_type: str) -> dict:
+        extra_args = {'CacheControl': IMMUTABLE_CACHE_CONTROL}
+        if content_type:
+            extra_args['ContentType'] = content_type
+        return extra_args
+
+    @staticmethod
+    def _is_missing(error) -> bool:
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def _remember_refresh(self, key: str, refreshed_at: float):
+        with self._lock:
+            self._refreshed[key] = refreshed_at
+            self._refreshed.move_to_end(key)
+            while len(self._refreshed) > S3_REFRESHED_KEYS:
+                self._refreshed.popitem(last=False)
+
+    def put(self, key: str, data: bytes, content_type: str = None, ttl: float = None):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data, **self._extra_args(content_type))
+        self._remember_refresh(key, time.time())
+
+    def put_stream(self, key: str, stream, content_type: str = None, ttl: float = None):
+        # upload_fileobj switches to a multipart upload for large objects
+        self.client.upload_fileobj(
+            stream, self.bucket, self._object_key(key), ExtraArgs=self._extra_args(content_type)
+        )
+        self._remember_refresh(key, time.time())
+
+    def _get_object(self, key: str):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def get(self, key: str):
+        response = self._get_object(key)
+        return response['Body'].read() if response is not None else None
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE):
+        response = self._get_object(key)
+        return response['Body'].iter_chunks(chunk_size) if response is not None else None
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def refresh(self, key: str, ttl: float = None) -> bool:
+        now = time.time()
+        with self._lock:
+            refreshed_at = self._refreshed.get(key)
+        if refreshed_at is not None and now - refreshed_at < self.refresh_interval:
+            return True
+        object_key = self._object_key(key)
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=object_key)
+            refreshed_at = head['LastModified'].timestamp()
+            if now - refreshed_at >= self.refresh_interval:
+                # Lifecycle rules expire by LastModified, which an in-place server-side copy resets
+                self.client.copy_object(
+                    Bucket=self.bucket,
+                    Key=object_key,
+                    CopySource={'Bucket': self.bucket, 'Key': object_key},
+                    MetadataDirective='REPLACE',
+                    **self._extra_args(head.get('ContentType')),
+                )
+                refreshed_at = now
+        except ClientError as e:
+            if self._is_missing(e):
+                with self._lock:
+                    self._refreshed.pop(key, None)
+                return False
+            raise
+        self._remember_refresh(key, refreshed_at)
+        return True
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        with self._lock:
+            self._refreshed.pop(key, None)
+
+    def url(self, key: str):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self._object_key(key)},
+            ExpiresIn=int(self.presign_ttl),
+        )
+
+    def stats(self) -> dict:
+        return {'backend': type(self).__name__, 'bucket': self.bucket, 'prefix': self.prefix}
+
+def create_storage_backend(namespace: str, local_root: str, local_ttl: float) -> StorageBackend:
+    """Backend for one kind of artifact: its own directory locally, its own key prefix in S3."""
+    if ARTIFACT_BACKEND == "local":
+        return LocalStorageBackend(local_root, local_ttl)
+    if ARTIFACT_BACKEND == "s3":
+        if not S3_BUCKET:
+            raise RuntimeError("ARTIFACT_BACKEND=s3 requires S3_BUCKET")
+        prefix = "/".join(part for part in (S3_PREFIX.strip('/'), namespace) if part)
+        return S3StorageBackend(S3_BUCKET, prefix, S3_ENDPOINT_URL, S3_REGION, S3_PRESIGN_TTL, S3_REFRESH_INTERVAL)
+    raise RuntimeError(f"Unsupported ARTIFACT_BACKEND: {ARTIFACT_BACKEND}")
+
+artifact_backend = create_storage_backend("artifacts", ARTIFACT_DIR, ARTIFACT_TTL)
+derivative_backend = create_storage_backend("derivatives", DERIVATIVE_DIR, DERIVATIVE_TTL)
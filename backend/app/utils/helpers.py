@@ -1,20 +1,47 @@
 # helpers.py
 
+import os
+import re
 import yaml
 
+# The llm2 prompt separates its three diagrams with comments like "# Diagram 2 - Data Flow"
+DIAGRAM_SEPARATOR_PATTERN = re.compile(
+    r"^[ \t]*#[^\n]*\b(?:diagram\s*\d+|(?:first|second|third)\s+diagram)\b", re.IGNORECASE | re.MULTILINE
+)
+
+CODE_BLOCK_PATTERN = re.compile(r"```[ \t]*(\w+)?[ \t]*\r?\n(.*?)\r?\n[ \t]*```", re.DOTALL)
+
 def load_aws_services(file_path: str):
     """Load AWS services from a YAML file."""
     with open(file_path, 'r') as file:
         return yaml.safe_load(file)
 
-def get_icons_by_categories(services: list, categories: list) -> dict:
-    """Retrieve icons corresponding to the specified categories."""
-    category_icons = {}
-    for category in categories:
-        for service in services:
-            if service.get('category') == category:
-                category_icons[category] = service.get('icons', [])
-                break
-        else:
-            category_icons[category] = []
-    return category_icons
\ No newline at end of file
+def image_url(image: str) -> str:
+    """Prepend the server URL to an artifact key."""
+    server_url = os.getenv("SERVER_URL", "http://localhost:8000")
+    return f"{server_url}/images/{image}"
+
+def extract_python_code(text: str) -> str:
+    """Join the python code blocks of an LLM reply, or return the text if it has none."""
+    blocks = [
+        code for language, code in CODE_BLOCK_PATTERN.findall(text)
+        if (language or "python").lower() in ("python", "py")
+    ]
+    return "\n\n".join(blocks) if blocks else text
+
+def split_diagrams(diagram_code: str) -> list:
+    """Split generated code into one standalone script per diagram.
+
+    Anything before the first separator comment (usually shared imports) is
+    prepended to every diagram so each script runs on its own.
+    """
+    code = extract_python_code(diagram_code)
+    starts = [match.start() for match in DIAGRAM_SEPARATOR_PATTERN.finditer(code)]
+    if len(starts) < 2:
+        return [code]
+    preamble = code[:starts[0]].strip()
+    units = []
+    for start, end in zip(starts, starts[1:] + [len(code)]):
+        unit = code[start:end].strip()
+        units.append(f"{preamble}\n\n{unit}" if preamble else unit)
+    return units
@@ -4,6 +4,134 @@ import os
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Point at any OpenAI-compatible server, e.g. the benchmark stub; None uses api.openai.com
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+
+# Shared LLM HTTP client: connection pool size and keep-alive
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+
+# Provider budgets enforced client-side; the token estimate per call is prompt + expected completion
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "30000"))
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "1500"))
+
+# Retries with jittered exponential backoff (seconds), bounded by each stage's deadline
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_STAGE_DEADLINES = {
+    "architecture": float(os.getenv("LLM_ARCHITECTURE_DEADLINE", "60")),
+    "diagram": float(os.getenv("LLM_DIAGRAM_DEADLINE", "120")),
+}
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CLOUD_PROVIDERS = ("aws", "azure", "gcp")
+
+# Parsed <provider>.yaml icon catalogs, rebuilt whenever one of the YAML files changes
+ICON_CATALOG_SNAPSHOT = os.getenv("ICON_CATALOG_SNAPSHOT", os.path.join(BASE_DIR, "cache", "icon_catalog.json"))
+
+# Content-addressed store for rendered images, served under /images
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(BASE_DIR, "artifacts"))
+
+# Rendered images are written through to the storage backend and the most recently used
+# ones are kept in memory, up to this many bytes
+ARTIFACT_MEMORY_BYTES = int(os.getenv("ARTIFACT_MEMORY_BYTES", str(128 * 1024 * 1024)))
+
+# Seconds a stored image stays on disk after it was last produced (local backend only)
+ARTIFACT_TTL = float(os.getenv("ARTIFACT_TTL", "300"))
+
+# Where artifacts and derivatives are stored: "local" (ARTIFACT_DIR / DERIVATIVE_DIR) or "s3".
+# The s3 backend needs boto3 (pip install -r requirements-s3.txt) and works with any
+# S3-compatible endpoint (MinIO, ...); expiry there is left to the bucket's lifecycle rules.
+ARTIFACT_BACKEND = os.getenv("ARTIFACT_BACKEND", "local")
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_PRESIGN_TTL = float(os.getenv("S3_PRESIGN_TTL", "3600"))
+
+# Objects still in use are re-copied onto themselves to restart their lifecycle expiry, at
+# most once per this many seconds; keep it well below the lifecycle rule's expiration
+S3_REFRESH_INTERVAL = float(os.getenv("S3_REFRESH_INTERVAL", str(24 * 60 * 60)))
+
+# Answer image requests with a redirect to a presigned backend URL, when the backend offers one
+ARTIFACT_REDIRECT = os.getenv("ARTIFACT_REDIRECT", "false").lower() in ("1", "true", "yes")
+
+# Cores available to this process; containers often get fewer than os.cpu_count()
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+# Maximum number of diagram renders allowed to run at the same time, never more than the cores
+RENDER_MAX_WORKERS = min(int(os.getenv("RENDER_MAX_WORKERS", str(CPU_COUNT))), CPU_COUNT)
+
+# Number of warm renderer processes and the per-job timeout in seconds
+RENDER_POOL_SIZE = min(int(os.getenv("RENDER_POOL_SIZE", str(RENDER_MAX_WORKERS))), CPU_COUNT)
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "30"))
+
+# Per-job rlimits of the render child and the Graphviz processes it starts; 0 disables one.
+# CPU seconds (RLIMIT_CPU), address space (RLIMIT_AS) and largest file written (RLIMIT_FSIZE)
+RENDER_CPU_SECONDS = int(os.getenv("RENDER_CPU_SECONDS", str(int(RENDER_TIMEOUT))))
+RENDER_MEMORY_BYTES = int(os.getenv("RENDER_MEMORY_BYTES", str(1024 * 1024 * 1024)))
+RENDER_OUTPUT_BYTES = int(os.getenv("RENDER_OUTPUT_BYTES", str(64 * 1024 * 1024)))
+RENDER_LIMITS = {
+    'cpu_seconds': RENDER_CPU_SECONDS,
+    'memory_bytes': RENDER_MEMORY_BYTES,
+    'output_bytes': RENDER_OUTPUT_BYTES,
+}
+
+# Canonical format renders are stored in; raster variants are derived on request
+RENDER_OUTPUT_FORMAT = os.getenv("RENDER_OUTPUT_FORMAT", "svg")
+
+# DOT sources and lazily rendered PNG/JPEG variants of SVG artifacts
+DERIVATIVE_DIR = os.getenv("DERIVATIVE_DIR", os.path.join(BASE_DIR, "cache", "derivatives"))
+DERIVATIVE_TTL = float(os.getenv("DERIVATIVE_TTL", str(24 * 60 * 60)))
+
+# Job API: concurrent LLM calls and renders are capped separately, the rest wait in a bounded queue
+JOB_MAX_LLM_CONCURRENCY = int(os.getenv("JOB_MAX_LLM_CONCURRENCY", "8"))
+JOB_MAX_RENDER_CONCURRENCY = int(os.getenv("JOB_MAX_RENDER_CONCURRENCY", str(RENDER_POOL_SIZE)))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "100"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "600"))
+
+# Batch generation: items processed at once per batch request, and the largest batch accepted
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+
+# Render cache for /execute-code: LRU entries kept in memory and byte budget of the disk tier
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", os.path.join(BASE_DIR, "cache", "renders"))
+RENDER_CACHE_MEMORY_ENTRIES = int(os.getenv("RENDER_CACHE_MEMORY_ENTRIES", "256"))
+RENDER_CACHE_DISK_BYTES = int(os.getenv("RENDER_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+
+# Graphviz output reused for diagrams whose DOT graph is the same up to node ids and statement
+# order; evicted least-recently-used beyond LAYOUT_CACHE_BYTES, 0 disables it
+LAYOUT_CACHE_DIR = os.getenv("LAYOUT_CACHE_DIR", os.path.join(BASE_DIR, "cache", "layouts"))
+LAYOUT_CACHE_BYTES = int(os.getenv("LAYOUT_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+# Exact-match cache of LLM responses; bump PROMPT_VERSION to invalidate it by hand
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(BASE_DIR, "cache", "llm_responses.sqlite3"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "2")
+
+# Upper bound on llm2 prompt tokens; icon lists are trimmed to fit
+LLM2_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM2_PROMPT_TOKEN_BUDGET", "3000"))
+
+# "code": llm2 writes Mingrammer Python that runs on the renderer pool.
+# "spec": llm2 returns a JSON graph spec that is compiled to DOT in-process.
+DIAGRAM_OUTPUT_MODES = ("code", "spec")
+DIAGRAM_OUTPUT_MODE = os.getenv("DIAGRAM_OUTPUT_MODE", "code")
+GRAPHVIZ_DOT = os.getenv("GRAPHVIZ_DOT", "dot")
+
+# "sequential": llm2 waits for the full llm1 reply.
+# "pipelined": llm1 is streamed and llm2 starts, from the project description and the
+# streamed category list, as soon as that list is complete.
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sequential")
+
+# Adds a Server-Timing header with per-stage durations to every response
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
 
 llm1 = """
 You are an {cloud_provider} Cloud Architecture expert specializing in analyzing project requirements and creating detailed architectural descriptions. You have deep knowledge of {cloud_provider} services, their interactions, and best practices for cloud architecture design.
@@ -226,4 +354,106 @@ llm1_schema = {
     ],
     "additionalProperties": False
   }
-}
\ No newline at end of file
+}
+
+llm2_spec = """
+You are an {cloud_provider} Cloud Architecture expert specializing in analyzing project requirements and designing clear architectural diagrams. You have deep knowledge of {cloud_provider} services, their interactions, and best practices for cloud architecture design.
+
+**TASK DESCRIPTION:**
+--------------------
+Analyze the provided Project Description and describe **three distinct architecture diagrams** as a JSON graph spec. Each diagram should present the architecture in a different manner, such as varying clusters, component groupings, or data flow representations, while maintaining high relevance to the project requirements.
+
+**GRAPH SPEC:**
+---------------
+- `diagrams`: the three diagrams, each with:
+    - `name`: diagram title.
+    - `direction`: layout direction; prefer "LR".
+    - `clusters`: groups of nodes, each with a unique `id`, a `label` and the `id` of its `parent` cluster (null at the top level).
+    - `nodes`: components, each with a unique `id`, a `label`, the `provider`, `category` and `icon` of its icon, and the `id` of its `cluster` (null outside clusters).
+    - `edges`: connections from `source` node id to `target` node id, with an optional `label` (empty string for none), a `style` and an arrow `direction`.
+
+**CONSTRAINTS:**
+---------------
+- Use only icons from the Icon List: `provider` is "{cloud_provider}", `category` is the Icon List key and `icon` is one of its icon names, with exactly the same case.
+- Users and generic servers may use provider "onprem" with category "client" (icon "User", "Users") or "compute" (icon "Server").
+- Include only justified components and ensure complete component connectivity.
+- Avoid visual clutter; group related services logically and keep a clear directional flow.
+- Follow the {cloud_provider} Well-Architected Framework.
+
+**INPUT VALID ICONS:**
+---------------------
+```json
+<icon_list> {icon_list} </icon_list>
+
+**PROJECT DESCRIPTION:**
+------------------------
+<project_description> {project_description} </project_description>
+"""
+
+llm2_spec_schema = {
+  "name": "diagram_spec_schema",
+  "strict": True,
+  "schema": {
+    "type": "object",
+    "properties": {
+      "diagrams": {
+        "type": "array",
+        "items": {
+          "type": "object",
+          "properties": {
+            "name": {"type": "string"},
+            "direction": {"type": "string", "enum": ["LR", "TB", "RL", "BT"]},
+            "clusters": {
+              "type": "array",
+              "items": {
+                "type": "object",
+                "properties": {
+                  "id": {"type": "string"},
+                  "label": {"type": "string"},
+                  "parent": {"type": ["string", "null"]}
+                },
+                "required": ["id", "label", "parent"],
+                "additionalProperties": False
+              }
+            },
+            "nodes": {
+              "type": "array",
+              "items": {
+                "type": "object",
+                "properties": {
+                  "id": {"type": "string"},
+                  "label": {"type": "string"},
+                  "provider": {"type": "string"},
+                  "category": {"type": "string"},
+                  "icon": {"type": "string"},
+                  "cluster": {"type": ["string", "null"]}
+                },
+                "required": ["id", "label", "provider", "category", "icon", "cluster"],
+                "additionalProperties": False
+              }
+            },
+            "edges": {
+              "type": "array",
+              "items": {
+                "type": "object",
+                "properties": {
+                  "source": {"type": "string"},
+                  "target": {"type": "string"},
+                  "label": {"type": "string"},
+                  "style": {"type": "string", "enum": ["solid", "dashed", "dotted", "bold"]},
+                  "direction": {"type": "string", "enum": ["forward", "back", "both", "none"]}
+                },
+                "required": ["source", "target", "label", "style", "direction"],
+                "additionalProperties": False
+              }
+            }
+          },
+          "required": ["name", "direction", "clusters", "nodes", "edges"],
+          "additionalProperties": False
+        }
+      }
+    },
+    "required": ["diagrams"],
+    "additionalProperties": False
+  }
+}
@@ -0,0 +1,326 @@
+# run_benchmark.py
+"""Offline end-to-end benchmark of /generate and /execute-code.
+
+Starts the stub LLM server and the API (with Server-Timing enabled and its
+caches in a temporary directory), drives each scenario at the given
+concurrency and reports throughput, p50/p95/p99 latency overall and per
+stage, and the peak RSS of the API process tree.
+
+    python -m benchmarks.run_benchmark --requests 40 --concurrency 8 --json results.json
+    python -m benchmarks.run_benchmark --baseline results.json --tolerance 0.2
+
+With --baseline the run fails (exit code 1) when a p95 latency regresses by
+more than the tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.stub_llm_server import DEFAULT_FIXTURES, load_fixtures, tag_titles
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+SCENARIOS = ("generate", "execute-code")
+
+PROJECT_DESCRIPTION = (
+    "DocuExtract is a document processing platform that extracts key fields from contract documents. "
+    "Users upload contracts through a Next.js frontend, a FastAPI backend chunks them, embeds the chunks "
+    "with a Hugging Face model, stores the embeddings in Milvus and extracts values with a reranker."
+)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values: list, fraction: float):
+    """Nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)), 1) - 1]
+
+def summarize(values: list) -> dict:
+    return {name: percentile(values, fraction) for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+
+def parse_server_timing(header: str) -> dict:
+    """Return {stage: seconds} from a Server-Timing header."""
+    timings = {}
+    for entry in filter(None, (part.strip() for part in header.split(","))):
+        name, *params = entry.split(";")
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                timings[name.strip()] = float(value) / 1000
+    return timings
+
+def strip_fences(code: str) -> str:
+    lines = [line for line in code.strip().splitlines() if not line.strip().startswith("```")]
+    return "\n".join(lines) + "\n"
+
+def process_tree(pid: int) -> list:
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as file:
+                pending.extend(int(child) for child in file.read().split())
+        except OSError:
+            pass
+    return pids
+
+def tree_rss_bytes(pid: int) -> int:
+    """Resident memory of pid and all its descendants (Linux only)."""
+    total = 0
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+class RSSSampler:
+    """Samples the API process tree's RSS in the background and keeps the peak."""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_bytes = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak_bytes = max(self.peak_bytes, await asyncio.to_thread(tree_rss_bytes, self.pid))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+def start_process(args: list, env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(args, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with status {process.returncode} during startup")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout:g}s")
+
+def build_request(scenario: str, index: int, fixture: dict, provider: str, warm: bool) -> dict:
+    # Unique inputs defeat the LLM and render caches unless --warm is given
+    suffix = "" if warm else f" (benchmark request {index})"
+    if scenario == "generate":
+        return {
+            "url": "/api/v1/diagrams/generate",
+            "data": {"cloud_provider": provider, "project_description": PROJECT_DESCRIPTION + suffix},
+        }
+    code = strip_fences(fixture["code"])
+    if not warm:
+        # Every diagram is cached separately, so each one needs to change
+        code = tag_titles(code, f"Run {index}")
+    return {
+        "url": "/api/v1/diagrams/execute-code",
+        "json": {"diagram_code": code, "architectural_description": PROJECT_DESCRIPTION},
+    }
+
+async def run_scenario(client: httpx.AsyncClient, scenario: str, args, fixtures: dict) -> dict:
+    provider = args.provider or next(iter(fixtures))
+    entries = fixtures[provider]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, stage_latencies = [], {}
+    failures = render_errors = 0
+
+    async def one(index: int):
+        nonlocal failures, render_errors
+        request = build_request(scenario, index, entries[index % len(entries)], provider, args.warm)
+        url = request.pop("url")
+        async with semaphore:
+            started_at = time.monotonic()
+            try:
+                response = await client.post(url, **request)
+            except httpx.HTTPError as e:
+                failures += 1
+                print(f"{scenario} request {index} failed: {e!r}")
+                return
+            elapsed = time.monotonic() - started_at
+        if response.status_code != 200:
+            failures += 1
+            print(f"{scenario} request {index} failed with {response.status_code}: {response.text[:200]}")
+            return
+        latencies.append(elapsed)
+        render_errors += len(response.json().get("errors", []))
+        for stage, seconds in parse_server_timing(response.headers.get("server-timing", "")).items():
+            stage_latencies.setdefault(stage, []).append(seconds)
+
+    started_at = time.monotonic()
+    await asyncio.gather(*(one(index) for index in range(args.requests)))
+    wall_seconds = time.monotonic() - started_at
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "failures": failures,
+        "render_errors": render_errors,
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(latencies) / wall_seconds if wall_seconds else 0,
+        "latency": summarize(latencies),
+        "stages": {stage: summarize(values) for stage, values in sorted(stage_latencies.items())},
+    }
+
+def format_ms(seconds) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+def print_report(results: dict):
+    for scenario, result in results["scenarios"].items():
+        print(f"\n== {scenario}: {result['requests']} requests at concurrency {result['concurrency']}")
+        print(f"throughput {result['throughput_rps']:.2f} req/s, {result['failures']} failed, "
+              f"{result['render_errors']} diagram errors, wall {result['wall_seconds']:.2f}s")
+        print(f"{'stage (ms, per request)':<28}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for name, summary in [("total", result["latency"])] + list(result["stages"].items()):
+            print(f"{name:<28}" + "".join(f"{format_ms(summary[key]):>10}" for key in ("p50", "p95", "p99")))
+    print(f"\npeak RSS of the API process tree: {results['peak_rss_bytes'] / 2 ** 20:.1f} MiB")
+
+def find_regressions(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    """List p95 latencies that grew by more than tolerance (and min_delta seconds) over the baseline."""
+    regressions = []
+    for scenario, result in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        pairs = [("total", result["latency"], previous["latency"])] + [
+            (stage, summary, previous["stages"][stage])
+            for stage, summary in result["stages"].items() if stage in previous["stages"]
+        ]
+        for name, current, before in pairs:
+            if current["p95"] is None or not before["p95"]:
+                continue
+            # Sub-millisecond stages jitter by large ratios, so small absolute changes are ignored
+            if current["p95"] > before["p95"] * (1 + tolerance) and current["p95"] - before["p95"] > min_delta:
+                regressions.append(
+                    f"{scenario}/{name}: p95 {format_ms(before['p95'])}ms -> {format_ms(current['p95'])}ms"
+                )
+    return regressions
+
+async def run(args) -> dict:
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"No fixtures match {args.fixtures}")
+    if args.provider and args.provider not in fixtures:
+        raise SystemExit(f"No {args.provider} fixtures; available: {', '.join(fixtures)}")
+
+    with tempfile.TemporaryDirectory(prefix="diagram-benchmark-") as work_dir:
+        stub_port, api_port = free_port(), free_port()
+        env = dict(os.environ)
+        env.update({
+            "OPENAI_API_KEY": "benchmark",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+            "SERVER_TIMING_ENABLED": "true",
+            "SERVER_URL": f"http://127.0.0.1:{api_port}",
+            "ARTIFACT_DIR": os.path.join(work_dir, "artifacts"),
+            "RENDER_CACHE_DIR": os.path.join(work_dir, "renders"),
+            "DERIVATIVE_DIR": os.path.join(work_dir, "derivatives"),
+            "LAYOUT_CACHE_DIR": os.path.join(work_dir, "layouts"),
+            "LLM_CACHE_PATH": os.path.join(work_dir, "llm_responses.sqlite3"),
+            # The stub has no quota, so keep client-side rate limiting out of the numbers
+            "LLM_REQUESTS_PER_MINUTE": "1000000",
+            "LLM_TOKENS_PER_MINUTE": "1000000000",
+        })
+        stub = start_process([
+            sys.executable, "-m", "benchmarks.stub_llm_server",
+            "--port", str(stub_port),
+            "--fixtures", args.fixtures,
+            "--latency", str(args.llm_latency),
+            "--tokens-per-second", str(args.tokens_per_second),
+        ], env, os.path.join(work_dir, "stub.log"))
+        api = start_process([
+            sys.executable, "-m", "uvicorn", "backend.app.main:app",
+            "--port", str(api_port), "--log-level", "warning",
+        ], env, os.path.join(work_dir, "api.log"))
+        try:
+            await wait_until_ready(f"http://127.0.0.1:{stub_port}/docs", stub, args.startup_timeout)
+            await wait_until_ready(f"http://127.0.0.1:{api_port}/", api, args.startup_timeout)
+
+            sampler = RSSSampler(api.pid)
+            sampler.start()
+            results = {"scenarios": {}}
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{api_port}", timeout=args.request_timeout, limits=limits
+            ) as client:
+                for scenario in args.scenarios:
+                    results["scenarios"][scenario] = await run_scenario(client, scenario, args, fixtures)
+            await sampler.stop()
+            results["peak_rss_bytes"] = sampler.peak_bytes
+            return results
+        finally:
+            for process in (api, stub):
+                process.terminate()
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--provider", help="Cloud provider to request; defaults to the first with fixtures")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="Glob of recorded LLM2 replies")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Stub seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Stub generation speed; 0 is instant")
+    parser.add_argument("--warm", action="store_true", help="Repeat identical inputs so caches are hit")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare p95 latencies with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p95 slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=5, help="Ignore p95 slowdowns smaller than this")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance, args.min_delta_ms / 1000)
+        if regressions:
+            print("\nRegressions beyond tolerance:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo p95 regressions beyond tolerance.")
+
+if __name__ == "__main__":
+    main()
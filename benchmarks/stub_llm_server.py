@@ -0,0 +1,167 @@
+# stub_llm_server.py
+"""OpenAI-compatible chat completions server that replays recorded diagram code.
+
+Every code_exe/generated_diagram_*.py file is an LLM2 fixture. The LLM1
+(architecture) reply is derived from a fixture of the requested provider: its
+categories are the ones the fixture imports, and the description echoes the
+project description so each distinct request stays a distinct cache key.
+Diagram titles in LLM2 replies are tagged with a digest of the prompt's
+project description for the same reason, so renders aren't cache hits either.
+
+    python -m benchmarks.stub_llm_server --port 8100 --latency 0.5 --tokens-per-second 200
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_FIXTURES = os.path.join(BASE_DIR, "code_exe", "generated_diagram_*.py")
+
+PROVIDER_PATTERN = re.compile(r"You are an? (aws|azure|gcp) Cloud", re.IGNORECASE)
+IMPORT_PATTERN = re.compile(r"^\s*from\s+diagrams\.(aws|azure|gcp)\.(\w+)\s+import", re.MULTILINE)
+DESCRIPTION_PATTERN = re.compile(r"<project_description>(.*?)</project_descriptio", re.DOTALL)
+TITLE_PATTERN = re.compile(r"""\bDiagram\(\s*(["'])""")
+
+# Size of the content pieces streamed back, in characters
+STREAM_CHUNK_CHARS = 16
+
+def load_fixtures(pattern: str) -> dict:
+    """Group fixture code by the provider its imports use."""
+    fixtures = {}
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as file:
+            code = file.read()
+        imports = IMPORT_PATTERN.findall(code)
+        if not imports:
+            continue
+        provider = imports[0][0]
+        categories = sorted({category for fixture_provider, category in imports if fixture_provider == provider})
+        fixtures.setdefault(provider, []).append({'code': code, 'categories': categories})
+    return fixtures
+
+def tag_titles(code: str, tag: str) -> str:
+    """Prefix every Diagram title with tag."""
+    return TITLE_PATTERN.sub(lambda match: f"{match.group(0)}{tag} ", code)
+
+def description_digest(prompt: str) -> str:
+    match = DESCRIPTION_PATTERN.search(prompt)
+    description = (match.group(1) if match else prompt).strip()
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()[:12]
+
+def approximate_tokens(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+def create_app(fixtures: dict, latency: float, tokens_per_second: float) -> FastAPI:
+    app = FastAPI(title="Stub LLM server")
+    rotation = {provider: itertools.cycle(entries) for provider, entries in fixtures.items()}
+    fallback = itertools.cycle([entry for entries in fixtures.values() for entry in entries])
+
+    def pick_fixture(prompt: str) -> dict:
+        match = PROVIDER_PATTERN.search(prompt)
+        provider = match.group(1).lower() if match else None
+        return next(rotation[provider]) if provider in rotation else next(fallback)
+
+    def architecture_reply(prompt: str, fixture: dict) -> str:
+        match = DESCRIPTION_PATTERN.search(prompt)
+        description = (match.group(1) if match else prompt).strip()
+        # Same key order as llm1_schema, which structured output follows
+        return json.dumps({
+            'icon_category_list': fixture['categories'],
+            'architectural_description': f"Replayed architecture {description_digest(prompt)}: {description[:500]}",
+        })
+
+    def completion_body(body: dict, content: str, prompt: str) -> dict:
+        prompt_tokens, completion_tokens = approximate_tokens(prompt), approximate_tokens(content)
+        return {
+            'id': f"chatcmpl-stub-{time.monotonic_ns()}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+    async def stream_body(body: dict, content: str, prompt: str):
+        chunk_id = f"chatcmpl-stub-{time.monotonic_ns()}"
+
+        def chunk(choices: list, usage: dict = None) -> str:
+            payload = {
+                'id': chunk_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': body.get('model', 'stub'),
+                'choices': choices,
+            }
+            if usage is not None:
+                payload['usage'] = usage
+            return f"data: {json.dumps(payload)}\n\n"
+
+        delay = STREAM_CHUNK_CHARS / 4 / tokens_per_second if tokens_per_second > 0 else 0
+        yield chunk([{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}])
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            if delay:
+                await asyncio.sleep(delay)
+            piece = content[start:start + STREAM_CHUNK_CHARS]
+            yield chunk([{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}])
+        yield chunk([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if (body.get('stream_options') or {}).get('include_usage'):
+            usage = completion_body(body, content, prompt)['usage']
+            yield chunk([], usage)
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "\n".join(message.get('content') or '' for message in body.get('messages', []))
+        fixture = pick_fixture(prompt)
+        if (body.get('response_format') or {}).get('type') == 'json_schema':
+            content = architecture_reply(prompt, fixture)
+        else:
+            content = tag_titles(fixture['code'], description_digest(prompt))
+
+        await asyncio.sleep(latency)
+        if body.get('stream'):
+            return StreamingResponse(stream_body(body, content, prompt), media_type="text/event-stream")
+        if tokens_per_second > 0:
+            await asyncio.sleep(approximate_tokens(content) / tokens_per_second)
+        return JSONResponse(completion_body(body, content, prompt))
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="Glob of recorded LLM2 replies")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Generation speed; 0 replies at once")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"No fixtures match {args.fixtures}")
+    print(f"Loaded fixtures: { {provider: len(entries) for provider, entries in fixtures.items()} }")
+    app = create_app(fixtures, args.latency, args.tokens_per_second)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
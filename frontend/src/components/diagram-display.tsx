@@ -38,12 +38,12 @@ export function DiagramDisplay({ diagrams, isLoading }: DiagramDisplayProps) {
   const handleExportAll = async () => {
     for (const imgUrl of diagrams) {
       try {
-        const response = await fetch(imgUrl);
-        const blob = await response.blob();
         const extension = selectedFormat.toLowerCase();
-        const imageBlob =
-          extension === "jpg" ? new Blob([blob], { type: "image/jpeg" }) : blob;
-        const downloadUrl = window.URL.createObjectURL(imageBlob);
+        // Diagrams are stored as SVG; the server derives PNG/JPG on request
+        const exportUrl = extension === "svg" ? imgUrl : `${imgUrl}?format=${extension}`;
+        const response = await fetch(exportUrl);
+        const blob = await response.blob();
+        const downloadUrl = window.URL.createObjectURL(blob);
         const link = document.createElement("a");
         link.href = downloadUrl;
         link.download = `architecture-diagram.${extension}`;
@@ -1,9 +1,10 @@
 # test.py
 
+import asyncio
 from backend.app.services.architecture_diagram import ArchitectureService
 from backend.app.services.diagram_service import DiagramService
 
-def main():
+async def main():
     project_description = """
     Project Overview
 
@@ -16,15 +17,16 @@ def main():
 
     try:
         cloud_provider = "aws"
-        architecture = ArchitectureService.process_project_description(project_description, cloud_provider)
-        diagram_code = DiagramService.generate_diagram(architecture, cloud_provider)
-        images = DiagramService.execute_code_and_get_images(diagram_code)
+        architecture = await ArchitectureService.process_project_description(project_description, cloud_provider)
+        diagram_code = await DiagramService.generate_diagram(architecture, cloud_provider)
+        images, errors = await DiagramService.render_images(diagram_code)
         print("Architectural Description:\n", architecture['architectural_description'])
         print("\nRelevant AWS Service Categories:\n", architecture['icon_category_list'])
         print("\nDiagram Code:\n", diagram_code)
         print("\nGenerated Images:\n", images)
+        print("\nDiagram Errors:\n", errors)
     except Exception as e:
         print(f"An error occurred: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,77 @@
+# test_code_validator.py
+
+import pytest
+
+from backend.app.services.code_validator import validate_diagram_code
+from backend.app.services.renderer_pool import restricted_globals
+
+VALID_DIAGRAM = '''
+from diagrams import Diagram, Cluster
+from diagrams.aws.compute import EC2
+import diagrams.aws.database
+
+with Diagram("Web", show=False):
+    with Cluster("App"):
+        EC2("web") >> diagrams.aws.database.RDS("db")
+'''
+
+@pytest.mark.parametrize("code", [
+    "import diagrams\ndiagrams.os.system('id')",
+    "import diagrams as d\nd.os.system('id')",
+    "import diagrams.aws\ndiagrams.os.system('id')",
+    "import diagrams.aws.compute\ndiagrams.aws.compute.os",
+    "from diagrams import os\nos.system('id')",
+    "from diagrams import os as shell\nshell.system('id')",
+    "from diagrams import getdiagram\ngetdiagram()",
+    "from diagrams import *\nos.system('id')",
+    "import diagrams\nx = diagrams\nx.os.system('id')",
+    "from diagrams import aws\nx = aws\nx.os",
+    "import diagrams\nx = diagrams.aws\nx.os",
+    "import diagrams\n[m.os for m in [diagrams]]",
+    "__builtins__['__import__']('os').system('id')",
+    "b = __builtins__\nb['__import__']('os').system('id')",
+    "__loader__.load_module('os')",
+])
+def test_rejects_reaching_modules_through_diagrams(code):
+    assert not validate_diagram_code(code).ok
+
+def test_accepts_diagram_code():
+    result = validate_diagram_code(VALID_DIAGRAM)
+    assert result.ok, result.errors
+
+@pytest.mark.parametrize("code", [
+    "__import__('os')",
+    "import os",
+    "import subprocess",
+    "open('/etc/passwd')",
+])
+def test_exec_globals_only_allow_diagrams(code):
+    with pytest.raises((ImportError, NameError)):
+        exec(code, restricted_globals())
+
+def test_exec_globals_run_diagram_imports():
+    exec("from diagrams import Diagram\nimport diagrams.aws.compute", restricted_globals())
+
+@pytest.mark.parametrize("code, fixed", [
+    # Wrong case
+    ("from diagrams.aws.compute import Ec2", "from diagrams.aws.compute import EC2 as Ec2"),
+    # Right name, wrong category
+    ("from diagrams.aws.compute import RDS", "from diagrams.aws.database import RDS"),
+    # Typo in a module outside the icon catalog
+    ("from diagrams.onprem.client import Userr", "from diagrams.onprem.client import User as Userr"),
+    ("from diagrams.onprem.client import Users, Userr as U", "from diagrams.onprem.client import Users, User as U"),
+])
+def test_rewrites_near_miss_imports(code, fixed):
+    result = validate_diagram_code(code)
+    assert result.ok, result.errors
+    assert result.code == fixed
+    assert len(result.rewrites) == 1
+
+@pytest.mark.parametrize("code", [
+    "from diagrams.aws.compute import Zzzzq",
+    "from diagrams.onprem.client import Zzzzq",
+])
+def test_rejects_imports_without_close_icon(code):
+    result = validate_diagram_code(code)
+    assert not result.ok
+    assert "is not a valid icon" in result.errors[0]
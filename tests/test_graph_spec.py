@@ -0,0 +1,21 @@
+# test_graph_spec.py
+
+from backend.app.services.graph_spec import validate_spec, diagram_errors
+
+DIAGRAM = {
+    "name": "Web",
+    "direction": "LR",
+    "clusters": [],
+    "nodes": [{"id": "a", "provider": "aws", "category": "compute", "icon": "EC2", "label": "a", "cluster": None}],
+    "edges": [],
+}
+
+def test_malformed_diagram_only_fails_itself():
+    spec = {"diagrams": [DIAGRAM, {**DIAGRAM, "extra": 1}]}
+    assert validate_spec(spec) == []
+    assert diagram_errors(spec["diagrams"][0], 0) == []
+    assert diagram_errors(spec["diagrams"][1], 1) == ["spec.diagrams[1]: unexpected 'extra'"]
+
+def test_envelope_is_checked():
+    assert validate_spec({"diagrams": [DIAGRAM], "extra": 1}) == ["spec: unexpected 'extra'"]
+    assert validate_spec({"diagrams": {}}) == ["spec.diagrams: expected array"]
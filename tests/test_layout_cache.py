@@ -0,0 +1,43 @@
+# test_layout_cache.py
+
+import os
+
+from backend.app.services.layout_cache import LayoutCache
+
+def put(cache: LayoutCache, key: str, size: int):
+    cache.put(key, "svg", b"s" * size, b"g" * size)
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    # Every entry is 200 bytes: 100 of output and 100 of source
+    cache = LayoutCache(str(tmp_path), max_bytes=600)
+    for key in ("aa1", "bb2", "cc3"):
+        put(cache, key, 100)
+        cache.record("svg", [], [key])
+    # A hit makes aa1 the most recently used
+    cache.record("svg", ["aa1"], [])
+    put(cache, "dd4", 100)
+    cache.record("svg", [], ["dd4"])
+
+    assert cache.get("bb2", "svg") is None
+    for key in ("aa1", "cc3", "dd4"):
+        assert cache.get(key, "svg") is not None
+    stats = cache.stats()
+    assert stats["layout_cache_evictions"] == 1
+    assert stats["layout_cache_bytes"] == 600
+
+def test_indexes_entries_left_by_a_previous_run(tmp_path):
+    put(LayoutCache(str(tmp_path), max_bytes=1000), "aa1", 100)
+    old_time = os.path.getmtime(tmp_path / "aa" / "aa1.svg") - 60
+    for extension in ("svg", "gv"):
+        os.utime(tmp_path / "aa" / f"aa1.{extension}", (old_time, old_time))
+
+    cache = LayoutCache(str(tmp_path), max_bytes=300)
+    put(cache, "bb2", 100)
+    cache.record("svg", [], ["bb2"])
+
+    assert cache.get("aa1", "svg") is None
+    assert cache.get("bb2", "svg") is not None
+    assert cache.stats()["layout_cache_bytes"] == 200
+
+def test_no_lookups_have_zero_hit_rate(tmp_path):
+    assert LayoutCache(str(tmp_path), max_bytes=1000).stats()["layout_cache_hit_rate"] == 0.0
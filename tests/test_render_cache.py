@@ -0,0 +1,18 @@
+# test_render_cache.py
+
+from backend.app.services import render_cache
+
+CODE = "with Diagram('Web', show=False):\n    EC2('web')\n"
+
+def test_key_ignores_comments_and_whitespace():
+    assert render_cache.code_hash(CODE) == render_cache.code_hash("# web\n" + CODE.replace("'Web',", "'Web' ,"))
+
+def test_key_changes_with_output_format(monkeypatch):
+    before = render_cache.code_hash(CODE)
+    monkeypatch.setattr(render_cache, "RENDER_OUTPUT_FORMAT", "png")
+    assert render_cache.code_hash(CODE) != before
+
+def test_key_changes_with_renderer_version(monkeypatch):
+    before = render_cache.code_hash(CODE)
+    monkeypatch.setattr(render_cache, "renderer_version", lambda: "diagrams 0.0.0; dot - graphviz version 0.0.0")
+    assert render_cache.code_hash(CODE) != before
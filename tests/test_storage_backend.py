@@ -0,0 +1,93 @@
+# test_storage_backend.py
+
+from collections import Counter
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from backend.app.services.storage_backend import S3StorageBackend, IMMUTABLE_CACHE_CONTROL
+
+BUCKET = "artifacts"
+KEY = "ab/abcdef.svg"
+
+class CountingClient:
+    """Passes calls through to a boto3 client, counting them by operation."""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+            return method(*args, **kwargs)
+        return call
+
+@pytest.fixture
+def client():
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        yield CountingClient(s3)
+
+def make_backend(client, refresh_interval=3600):
+    return S3StorageBackend(BUCKET, prefix="renders", refresh_interval=refresh_interval, client=client)
+
+def test_round_trip(client):
+    backend = make_backend(client)
+    assert backend.get(KEY) is None
+    assert backend.iter_chunks(KEY) is None
+    assert not backend.exists(KEY)
+
+    backend.put(KEY, b"<svg/>", content_type="image/svg+xml")
+    assert backend.exists(KEY)
+    assert backend.get(KEY) == b"<svg/>"
+    assert b"".join(backend.iter_chunks(KEY, chunk_size=2)) == b"<svg/>"
+    head = client.client.head_object(Bucket=BUCKET, Key=f"renders/{KEY}")
+    assert head["ContentType"] == "image/svg+xml"
+    assert head["CacheControl"] == IMMUTABLE_CACHE_CONTROL
+    assert f"renders/{KEY}" in backend.url(KEY)
+
+    backend.delete(KEY)
+    assert not backend.exists(KEY)
+    assert not backend.refresh(KEY)
+
+def test_put_stream(client, tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"png" * 1000)
+    backend = make_backend(client)
+    with open(path, "rb") as file:
+        backend.put_stream("cd/cdef.png", file, content_type="image/png")
+    assert backend.get("cd/cdef.png") == b"png" * 1000
+
+def test_refresh_within_interval_makes_no_requests(client):
+    backend = make_backend(client)
+    backend.put(KEY, b"<svg/>", content_type="image/svg+xml")
+    client.calls.clear()
+    assert backend.refresh(KEY)
+    assert backend.refresh(KEY)
+    assert sum(client.calls.values()) == 0
+
+def test_refresh_of_recent_object_only_checks_it(client):
+    make_backend(client).put(KEY, b"<svg/>", content_type="image/svg+xml")
+    # Another worker, which has not seen the object yet
+    backend = make_backend(client)
+    client.calls.clear()
+    assert backend.refresh(KEY)
+    assert backend.refresh(KEY)
+    assert client.calls == Counter({"head_object": 1})
+
+def test_refresh_after_interval_copies_in_place(client):
+    backend = make_backend(client, refresh_interval=0)
+    backend.put(KEY, b"<svg/>", content_type="image/svg+xml")
+    client.calls.clear()
+    assert backend.refresh(KEY)
+    assert client.calls == Counter({"head_object": 1, "copy_object": 1})
+    head = client.client.head_object(Bucket=BUCKET, Key=f"renders/{KEY}")
+    assert head["ContentType"] == "image/svg+xml"
+    assert head["CacheControl"] == IMMUTABLE_CACHE_CONTROL
+    assert backend.get(KEY) == b"<svg/>"